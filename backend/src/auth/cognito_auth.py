@@ -1,9 +1,12 @@
 from fastapi import APIRouter, HTTPException, Header
 import os
-import boto3
+import hashlib
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from jose import jwt 
+from utils.cache import ExpiringLRUCache
+from utils.aws_clients import create_client
+from .jwt_verifier import verify_token, TokenVerificationError
 
 # Carica variabili da .env
 load_dotenv()
@@ -14,8 +17,14 @@ CLIENT_ID = os.getenv("CLIENT_ID")
 IDENTITY_POOL_ID = os.getenv("IDENTITY_POOL_ID")
 
 # Clienti AWS
-cognito_idp = boto3.client("cognito-idp", region_name=AWS_REGION)
-cognito_identity = boto3.client("cognito-identity", region_name=AWS_REGION)
+cognito_idp = create_client("cognito-idp")
+cognito_identity = create_client("cognito-identity")
+
+# Cache delle credenziali temporanee Cognito Identity, condivisa da tutte le route.
+# Le credenziali vengono rinnovate CREDENTIALS_SAFETY_MARGIN secondi prima della scadenza.
+CREDENTIALS_CACHE_SIZE = int(os.getenv("CREDENTIALS_CACHE_SIZE", "1024"))
+CREDENTIALS_SAFETY_MARGIN = int(os.getenv("CREDENTIALS_SAFETY_MARGIN", "300"))
+credentials_cache = ExpiringLRUCache(max_entries=CREDENTIALS_CACHE_SIZE, name='cognito_credentials')
 
 def sign_up(username, password, email):
     try:
@@ -101,28 +110,59 @@ def validate_token(access_token):
     except ClientError as e:
         return {"error": e.response['Error']['Message']}
 
-def get_cognito_credentials(id_token: str):
+def _credentials_cache_key(id_token: str) -> tuple:
+    """
+    Chiave della cache: subject del token più il digest del token stesso,
+    così un token con claim falsificati non può leggere l'entry di un altro utente.
+    """
     try:
-        cognito_identity = boto3.client('cognito-identity', region_name=AWS_REGION)
-        
-        response = cognito_identity.get_id(
+        subject = jwt.get_unverified_claims(id_token).get("sub")
+    except Exception:
+        subject = None
+    return (subject, hashlib.sha256(id_token.encode()).hexdigest())
+
+
+def _fetch_identity_credentials(id_token: str) -> dict:
+    """
+    Scambia l'ID token con credenziali temporanee (get_id + get_credentials_for_identity),
+    riutilizzando il risultato finché non è prossimo alla scadenza.
+    """
+    def load():
+        provider = f"cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}"
+        identity = cognito_identity.get_id(
             IdentityPoolId=IDENTITY_POOL_ID,
-            Logins={
-                f'cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}': id_token
-            }
+            Logins={provider: id_token}
         )
-        
-        identity_id = response['IdentityId']
-        
-        credentials_response = cognito_identity.get_credentials_for_identity(
-            IdentityId=identity_id,
-            Logins={
-                f'cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}': id_token
-            }
+        creds = cognito_identity.get_credentials_for_identity(
+            IdentityId=identity["IdentityId"],
+            Logins={provider: id_token}
         )
-        
-        return credentials_response['Credentials']
-        
+        result = {
+            "IdentityId": identity["IdentityId"],
+            "Credentials": creds["Credentials"]
+        }
+
+        expires_at = creds["Credentials"]["Expiration"].timestamp() - CREDENTIALS_SAFETY_MARGIN
+        # Non servire credenziali oltre la scadenza del token che le ha ottenute
+        try:
+            token_exp = jwt.get_unverified_claims(id_token).get("exp")
+            if token_exp:
+                expires_at = min(expires_at, float(token_exp))
+        except Exception:
+            pass
+        return result, expires_at
+
+    return credentials_cache.get_or_load(_credentials_cache_key(id_token), load)
+
+
+def get_cognito_credentials(id_token: str):
+    # Verifica locale (firma, scadenza, client) prima dello scambio con Cognito Identity
+    try:
+        verify_token(id_token, token_use="id")
+    except TokenVerificationError as e:
+        raise HTTPException(status_code=401, detail=f"Token non valido: {str(e)}")
+    try:
+        return _fetch_identity_credentials(id_token)["Credentials"]
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Errore nell'ottenere credenziali: {str(e)}")
 
@@ -132,38 +172,20 @@ def get_temporary_credentials(id_token):
         if not id_token:
             return {"error": "ID token mancante"}
 
-        decoded = jwt.decode(
-            id_token,
-            key="",
-            options={
-                "verify_signature": False,
-                "verify_aud": False,
-                "verify_at_hash": False
-            }
-        )
-        aud = decoded.get("aud")
-        token_use = decoded.get("token_use")
-        if aud != CLIENT_ID or token_use != "id":
-            return {"error": "Token non valido per le credenziali temporanee"}
-
-        provider = f"cognito-idp.{AWS_REGION}.amazonaws.com/{USER_POOL_ID}"
-
-        identity = cognito_identity.get_id(
-            IdentityPoolId=IDENTITY_POOL_ID,
-            Logins={provider: id_token}
-        )
+        try:
+            verify_token(id_token, token_use="id")
+        except TokenVerificationError as e:
+            return {"error": f"Token non valido per le credenziali temporanee: {str(e)}"}
 
-        creds = cognito_identity.get_credentials_for_identity(
-            IdentityId=identity["IdentityId"],
-            Logins={provider: id_token}
-        )
+        identity = _fetch_identity_credentials(id_token)
+        creds = identity["Credentials"]
 
         return {
             "IdentityId": identity["IdentityId"],
-            "AccessKeyId": creds["Credentials"]["AccessKeyId"],
-            "SecretKey": creds["Credentials"]["SecretKey"],
-            "SessionToken": creds["Credentials"]["SessionToken"],
-            "Expiration": creds["Credentials"]["Expiration"].isoformat()
+            "AccessKeyId": creds["AccessKeyId"],
+            "SecretKey": creds["SecretKey"],
+            "SessionToken": creds["SessionToken"],
+            "Expiration": creds["Expiration"].isoformat()
         }
 
     except ClientError as e:
@@ -0,0 +1,88 @@
+import time
+from typing import Optional
+from fastapi import Header, HTTPException, Request
+from utils import metrics
+from utils.aws_async import run_blocking
+from utils.aws_clients import s3_client_for, dynamodb_client_for
+from .cognito_auth import get_cognito_credentials
+from .jwt_verifier import verify_token, user_id_from_claims, TokenVerificationError
+
+
+class AuthContext:
+    """
+    Autenticazione risolta una volta per richiesta: token, claim verificati,
+    user id, credenziali temporanee Cognito e client AWS condivisi (dal pool
+    di utils.aws_clients) per quelle credenziali, già creati fuori dall'event loop.
+    """
+
+    def __init__(self, token: str, claims: dict, credentials: dict, s3, dynamodb, elapsed: float):
+        self.token = token
+        self.claims = claims
+        self.user_id = user_id_from_claims(claims)
+        self.credentials = credentials
+        self.s3 = s3
+        self.dynamodb = dynamodb
+        # Tempo speso per autenticare la richiesta (verifica, scambio credenziali e client)
+        self.elapsed = elapsed
+
+
+def _clients_for(credentials: dict):
+    # Creare un client costa ~100 ms alla prima richiesta e la cache prende un lock:
+    # entrambe le cose avvengono nel pool, non sull'event loop
+    return s3_client_for(credentials), dynamodb_client_for(credentials)
+
+
+async def requested_user_ids(request: Request) -> set:
+    """
+    User id indicati dal client: parametro di path {user_id} e campo userId del
+    body (JSON o form). FastAPI ha già letto il body, quindi json()/form() usano la copia in cache.
+    """
+    user_ids = {request.path_params.get('user_id')}
+    content_type = request.headers.get('content-type', '')
+    try:
+        if content_type.startswith('application/json'):
+            body = await request.json()
+            if isinstance(body, dict):
+                user_ids.add(body.get('userId'))
+        elif content_type.startswith(('multipart/form-data', 'application/x-www-form-urlencoded')):
+            user_ids.add((await request.form()).get('userId'))
+    except ValueError:
+        # Body non valido: lo segnala la validazione della route
+        pass
+    return {user_id for user_id in user_ids if isinstance(user_id, str) and user_id}
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):].strip() or None
+    return None
+
+
+async def get_auth_context(request: Request, authorization: Optional[str] = Header(None)) -> AuthContext:
+    """
+    Dipendenza FastAPI condivisa da tutti i router. FastAPI la risolve una sola
+    volta per richiesta anche se più dipendenze la richiedono. Uno user id del
+    path o del body diverso da quello del token viene rifiutato con 403.
+    """
+    token = bearer_token(authorization)
+    if not token:
+        raise HTTPException(status_code=401, detail="Token ID mancante")
+
+    start = time.perf_counter()
+    ok = False
+    try:
+        try:
+            claims = await run_blocking(verify_token, token, "id")
+        except TokenVerificationError as e:
+            raise HTTPException(status_code=401, detail=f"Token non valido: {str(e)}")
+        credentials = await run_blocking(get_cognito_credentials, token)
+        s3, dynamodb = await run_blocking(_clients_for, credentials)
+        ok = True
+    finally:
+        # Costo dell'autenticazione esposto su /metrics (auth_duration_seconds)
+        elapsed = time.perf_counter() - start
+        metrics.record_auth(elapsed, ok)
+    auth = AuthContext(token, claims, credentials, s3, dynamodb, elapsed)
+    if any(user_id != auth.user_id for user_id in await requested_user_ids(request)):
+        raise HTTPException(status_code=403, detail="UserId non corrisponde al token")
+    return auth
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Optional
+import requests
+from jose import jwt
+from jose.exceptions import JOSEError
+from utils.cache import ExpiringLRUCache
+
+AWS_REGION = os.getenv("AWS_REGION")
+USER_POOL_ID = os.getenv("USER_POOL_ID")
+CLIENT_ID = os.getenv("CLIENT_ID")
+
+# Ricarica periodica del JWKS (rotazione chiavi) e intervallo minimo tra due
+# ricariche forzate da un kid sconosciuto (evita di martellare Cognito con token falsi)
+JWKS_REFRESH_INTERVAL = int(os.getenv("JWKS_REFRESH_INTERVAL", "3600"))
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "60"))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "4096"))
+
+
+class TokenVerificationError(Exception):
+    pass
+
+
+class JWKSVerifier:
+    """
+    Verifica locale dei JWT Cognito: firma RS256 con le chiavi del JWKS del pool
+    (in cache per kid), exp, iss, aud/client_id e token_use. I token già verificati
+    restano in cache fino alla loro scadenza, quindi le richieste successive con lo
+    stesso token costano solo un hash.
+    """
+
+    def __init__(self, region: Optional[str], user_pool_id: Optional[str], client_id: Optional[str],
+                 fetch_jwks: Optional[Callable[[], dict]] = None,
+                 refresh_interval: int = JWKS_REFRESH_INTERVAL,
+                 min_refresh_interval: int = JWKS_MIN_REFRESH_INTERVAL,
+                 cache_size: int = VERIFIED_TOKEN_CACHE_SIZE):
+        self.issuer = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+        self.client_id = client_id
+        # fetch_jwks sostituibile con un key set locale (test, ambienti offline)
+        self._fetch_jwks = fetch_jwks or self._download_jwks
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._verified = ExpiringLRUCache(max_entries=cache_size)
+
+    def _download_jwks(self) -> dict:
+        response = requests.get(f"{self.issuer}/.well-known/jwks.json", timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    def _refresh(self):
+        try:
+            jwks = self._fetch_jwks()
+        except Exception as e:
+            # Con chiavi già in cache si continua a usarle: il JWKS cambia raramente
+            print(f"Download JWKS non riuscito: {str(e)}")
+            if not self._keys:
+                raise TokenVerificationError("Chiavi di verifica non disponibili")
+            return
+        self._keys = {key["kid"]: key for key in jwks.get("keys", [])}
+        self._fetched_at = time.time()
+
+    def get_key(self, kid: str) -> dict:
+        with self._lock:
+            age = time.time() - self._fetched_at
+            if age > self.refresh_interval or (kid not in self._keys and age > self.min_refresh_interval):
+                self._refresh()
+            key = self._keys.get(kid)
+        if key is None:
+            raise TokenVerificationError("Chiave di firma sconosciuta")
+        return key
+
+    def _decode(self, token: str) -> dict:
+        try:
+            header = jwt.get_unverified_header(token)
+        except JOSEError as e:
+            raise TokenVerificationError(f"Token malformato: {str(e)}")
+        if header.get("alg") != "RS256":
+            raise TokenVerificationError("Algoritmo di firma non ammesso")
+        key = self.get_key(header.get("kid"))
+        try:
+            # aud viene controllato sotto: gli access token Cognito usano client_id
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=["RS256"],
+                issuer=self.issuer,
+                options={"verify_aud": False, "verify_at_hash": False}
+            )
+        except JOSEError as e:
+            raise TokenVerificationError(str(e))
+
+        token_use = claims.get("token_use")
+        if token_use == "id":
+            audience = claims.get("aud")
+        elif token_use == "access":
+            audience = claims.get("client_id")
+        else:
+            raise TokenVerificationError("token_use non valido")
+        if audience != self.client_id:
+            raise TokenVerificationError("Token emesso per un altro client")
+        return claims
+
+    def verify(self, token: str, token_use: Optional[str] = None) -> dict:
+        """
+        Restituisce i claim del token verificato. Con token_use ("id" o "access")
+        accetta solo quel tipo di token. Solleva TokenVerificationError.
+        """
+        if not token:
+            raise TokenVerificationError("Token mancante")
+
+        def load():
+            claims = self._decode(token)
+            return claims, float(claims["exp"])
+
+        cache_key = hashlib.sha256(token.encode()).hexdigest()
+        claims = self._verified.get_or_load(cache_key, load)
+        if token_use and claims.get("token_use") != token_use:
+            raise TokenVerificationError(f"Serve un {token_use} token Cognito")
+        return claims
+
+
+verifier = JWKSVerifier(AWS_REGION, USER_POOL_ID, CLIENT_ID)
+
+
+def verify_token(token: str, token_use: Optional[str] = None) -> dict:
+    return verifier.verify(token, token_use)
+
+
+def user_id_from_claims(claims: dict) -> Optional[str]:
+    return claims.get("cognito:username") or claims.get("username") or claims.get("sub")
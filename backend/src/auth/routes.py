@@ -2,8 +2,10 @@ from fastapi import APIRouter, HTTPException, Depends, Header
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from typing import Optional
-from .cognito_auth import sign_up, sign_in, validate_token, confirm_sign_up, resend_confirmation_code
+from .cognito_auth import sign_up, sign_in, confirm_sign_up, resend_confirmation_code
+from .jwt_verifier import verify_token, user_id_from_claims, TokenVerificationError
 import os
+from utils.aws_async import run_blocking
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -26,31 +28,26 @@ class ResendCode(BaseModel):
     username: str
 
 async def get_current_user(authorization: Optional[str] = Header(None)):
+    """Claim del token (ID o access token) verificato localmente con il JWKS del pool."""
     if not authorization:
         raise HTTPException(status_code=401, detail="Non autorizzato")
     
     # Rimuovi il prefisso "Bearer " se presente
     token = authorization.replace("Bearer ", "") if authorization.startswith("Bearer ") else authorization
     
-    # Controlla prima se è un access token valido
     try:
-        # validate_token usa cognito_idp_client.get_user che richiede un Access Token
-        user = validate_token(token)
-        if isinstance(user, str):  # Se è una stringa, è un messaggio di errore
-            raise HTTPException(status_code=401, detail=user)
-        return user
-    except Exception as e:
-        # Se il token non è valido come Access Token, potrebbe essere un ID token
-        # In questo caso, non possiamo utilizzarlo direttamente con get_user
+        # Nessuna chiamata a Cognito: solo il primo token (o un kid nuovo) scarica il JWKS
+        return await run_blocking(verify_token, token)
+    except TokenVerificationError as e:
         print(f"Errore durante la validazione del token: {str(e)}")
         raise HTTPException(
             status_code=401, 
-            detail="Token non valido o scaduto. Utilizzare un Access Token valido."
+            detail="Token non valido o scaduto."
         )
 
 @router.post("/signup")
 async def register_user(user: UserSignUp):
-    response = sign_up(user.username, user.password, user.email)
+    response = await run_blocking(sign_up, user.username, user.password, user.email)
     if isinstance(response, str):  # Se è una stringa, è un messaggio di errore
         raise HTTPException(status_code=400, detail=response)
     
@@ -63,7 +60,7 @@ async def register_user(user: UserSignUp):
 
 @router.post("/confirm")
 async def confirm_account(confirm_data: UserConfirm):
-    response = confirm_sign_up(confirm_data.username, confirm_data.confirmation_code)
+    response = await run_blocking(confirm_sign_up, confirm_data.username, confirm_data.confirmation_code)
     if isinstance(response, str):  # Se è una stringa, è un messaggio di errore
         raise HTTPException(status_code=400, detail=response)
     
@@ -75,7 +72,7 @@ async def confirm_account(confirm_data: UserConfirm):
 
 @router.post("/resend-code")
 async def resend_verification(resend_data: ResendCode):
-    response = resend_confirmation_code(resend_data.username)
+    response = await run_blocking(resend_confirmation_code, resend_data.username)
     if isinstance(response, str):  # Se è una stringa, è un messaggio di errore
         raise HTTPException(status_code=400, detail=response)
     
@@ -86,7 +83,7 @@ async def resend_verification(resend_data: ResendCode):
 
 @router.post("/login")
 async def login_user(user: UserSignIn):
-    response = sign_in(user.username, user.password)
+    response = await run_blocking(sign_in, user.username, user.password)
 
     print(f"Risposta login: {response}")
 
@@ -107,7 +104,14 @@ async def login_user(user: UserSignIn):
 
 @router.get("/me")
 async def get_user_info(user = Depends(get_current_user)):
+    # Stessa forma della risposta di get_user: attributi ricavati dai claim del token
+    # (l'ID token contiene gli attributi standard, l'access token solo sub)
+    attributes = [
+        {"Name": name, "Value": str(user[name]).lower() if isinstance(user[name], bool) else str(user[name])}
+        for name in ("sub", "email", "email_verified", "name", "phone_number")
+        if name in user
+    ]
     return {
-        "username": user["Username"],
-        "user_attributes": user["UserAttributes"]
+        "username": user_id_from_claims(user),
+        "user_attributes": attributes
     }
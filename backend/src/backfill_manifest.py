@@ -0,0 +1,182 @@
+"""
+Ricostruisce il manifest ImageManifest e l'indice dei tag ImageTagIndex a partire
+dal bucket S3 e da ImageLabels, per le immagini caricate prima del manifest o per
+riallinearli.
+
+Usa le credenziali AWS dell'ambiente (non quelle Cognito dell'utente).
+
+Uso:
+    python backfill_manifest.py [user_id ...]   # senza argomenti: tutti gli utenti
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.aws_clients import create_client
+from utils.aws_async import run_blocking, gather_bounded
+from utils.dynamodb_batch import BATCH_MAX_RETRIES
+from utils import manifest, tag_index
+from routes.images import BUCKET_NAME, DYNAMODB_TABLE, parse_image_tags, image_record, group_albums
+
+DYNAMODB_BATCH_SIZE = 100
+TAG_BATCH_CONCURRENCY = int(os.getenv('TAG_BATCH_CONCURRENCY', '4'))
+METADATA_CONCURRENCY = int(os.getenv('METADATA_CONCURRENCY', '16'))
+
+
+def _batch_get_tags(dynamodb_client, image_keys: list) -> dict:
+    """Legge i tag di al massimo 100 chiavi con BatchGetItem, ritentando le UnprocessedKeys."""
+    request = {
+        DYNAMODB_TABLE: {
+            'Keys': [{'ImageKey': {'S': key}} for key in image_keys],
+            'ProjectionExpression': '#key, #names, #labels',
+            'ExpressionAttributeNames': {
+                '#key': 'ImageKey',
+                '#names': 'LabelNames',
+                '#labels': 'Labels'
+            }
+        }
+    }
+    tags = {}
+    attempt = 0
+    while request:
+        response = dynamodb_client.batch_get_item(RequestItems=request)
+        for item in response.get('Responses', {}).get(DYNAMODB_TABLE, []):
+            tags[item['ImageKey']['S']] = parse_image_tags(item)
+        request = response.get('UnprocessedKeys')
+        if request:
+            attempt += 1
+            if attempt > BATCH_MAX_RETRIES:
+                print(f"UnprocessedKeys non recuperate dopo {BATCH_MAX_RETRIES} tentativi")
+                break
+            # Backoff esponenziale sulle chiavi non elaborate (throttling)
+            time.sleep(min(0.05 * (2 ** attempt), 1.0))
+    return tags
+
+
+async def get_images_tags(dynamodb_client, image_keys: list) -> dict:
+    """
+    Restituisce {ImageKey: [tag]} per tutte le chiavi, con blocchi da 100
+    chiavi letti in parallelo. Le chiavi senza analisi hanno lista vuota.
+    """
+    tags = {key: [] for key in image_keys}
+    chunks = [image_keys[i:i + DYNAMODB_BATCH_SIZE] for i in range(0, len(image_keys), DYNAMODB_BATCH_SIZE)]
+    results = await gather_bounded(
+        TAG_BATCH_CONCURRENCY,
+        *(run_blocking(_batch_get_tags, dynamodb_client, chunk) for chunk in chunks),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Errore in get_images_tags: {str(result)}")
+        else:
+            tags.update(result)
+    return tags
+
+
+def _head_metadata(s3_client, key: str) -> dict:
+    try:
+        return s3_client.head_object(Bucket=BUCKET_NAME, Key=key).get('Metadata', {})
+    except Exception as meta_err:
+        print(f"Errore recupero metadata per {key}: {meta_err}")
+        return {}
+
+
+async def get_images_metadata(s3_client, objects: list) -> dict:
+    """
+    Restituisce {Key: Metadata} per gli oggetti del listing, con HEAD in parallelo
+    a concorrenza limitata. Nessuna cache: il backfill legge ogni oggetto una volta sola.
+    """
+    results = await gather_bounded(
+        METADATA_CONCURRENCY,
+        *(run_blocking(_head_metadata, s3_client, obj['Key']) for obj in objects)
+    )
+    return {obj['Key']: result for obj, result in zip(objects, results)}
+
+
+async def iter_image_pages(s3_client, user_id: str, page_size: Optional[int] = None, cursor: Optional[str] = None):
+    """Itera le pagine del listing S3 dell'utente come coppie (oggetti, next_cursor)."""
+    params = {'Bucket': BUCKET_NAME, 'Prefix': f"users/{user_id}/"}
+    if page_size:
+        params['MaxKeys'] = page_size
+    while True:
+        if cursor:
+            params['ContinuationToken'] = cursor
+        response = await run_blocking(s3_client.list_objects_v2, **params)
+        cursor = response.get('NextContinuationToken')
+        yield response.get('Contents', []), cursor
+        if not cursor:
+            return
+
+
+async def build_image_records(s3_client, dynamodb_client, user_id: str, objects: list):
+    """
+    Costruisce gli oggetti immagine (con tag e metadata) e il raggruppamento per album
+    a partire da una pagina di oggetti S3. Restituisce (images, albums).
+    """
+    images = []
+    image_objects = []
+    album_keys = []
+    for obj in objects:
+        key = obj['Key']
+        if key.endswith('/'):
+            album_keys.append(key)
+            continue
+        image_objects.append(obj)
+        images.append(image_record(user_id, key, obj['Size'], obj['LastModified'].isoformat(), [], {}))
+    # Tag (BatchGetItem parallele) e metadata (HEAD parallele) vengono recuperati in parallelo
+    image_tags, image_metadata = await asyncio.gather(
+        get_images_tags(dynamodb_client, [image['filename'] for image in images]),
+        get_images_metadata(s3_client, image_objects)
+    )
+    for image in images:
+        image['tags'] = image_tags.get(image['filename'], [])
+        image['metadata'] = image_metadata.get(image['filename'], {})
+    return images, group_albums(user_id, album_keys, images)
+
+
+
+async def list_users(s3_client) -> list:
+    users = []
+    params = {'Bucket': BUCKET_NAME, 'Prefix': 'users/', 'Delimiter': '/'}
+    while True:
+        response = await run_blocking(s3_client.list_objects_v2, **params)
+        users.extend(cp['Prefix'].split('/')[1] for cp in response.get('CommonPrefixes', []))
+        if not response.get('NextContinuationToken'):
+            return users
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+
+async def backfill_user(s3_client, dynamodb_client, user_id: str) -> int:
+    count = 0
+    async for objects, _ in iter_image_pages(s3_client, user_id):
+        images, albums = await build_image_records(s3_client, dynamodb_client, user_id, objects)
+        etags = {obj['Key']: obj.get('ETag') for obj in objects}
+        for album in albums:
+            await run_blocking(manifest.put_album, dynamodb_client, user_id, album)
+        for image in images:
+            await run_blocking(
+                manifest.put_image, dynamodb_client, user_id, image['filename'], image['size'],
+                image['last_modified'], image['metadata'], etags.get(image['filename']), image['tags']
+            )
+            # Posting già presenti (scritti dalla Lambda con la confidenza) restano invariati
+            tags = tag_index.entry_tags({'LabelNames': image['tags'], 'Metadata': image['metadata']})
+            await run_blocking(tag_index.add_postings, dynamodb_client, user_id, image['filename'], tags)
+        count += len(images)
+    return count
+
+
+async def main(user_ids: list):
+    s3_client = create_client('s3')
+    dynamodb_client = create_client('dynamodb')
+    for user_id in user_ids or await list_users(s3_client):
+        count = await backfill_user(s3_client, dynamodb_client, user_id)
+        print(f"{user_id}: {count} immagini registrate in {manifest.MANIFEST_TABLE} e {tag_index.TAG_INDEX_TABLE}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,16 +1,30 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import os
 from dotenv import load_dotenv
 from routes.upload import router as upload_router
 from routes.images import router as images_router
 from routes.auth import router as auth_router 
 from routes.album import router as album_router
+from routes.search import router as search_router
+from utils.json_response import FastJSONResponse
+from utils import metrics
 
 
 load_dotenv()
 
-app = FastAPI(title="AWS Backend API", version="1.0.0")
+# Sotto questa dimensione (byte) le risposte non vengono compresse
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+
+app = FastAPI(title="AWS Backend API", version="1.0.0", default_response_class=FastJSONResponse)
+
+# Brotli se brotli-asgi è installato (con gzip per i client che non lo supportano), altrimenti gzip
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,6 +34,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Aggiunto per ultimo: è il middleware più esterno e misura anche CORS e compressione
+app.add_middleware(metrics.MetricsMiddleware)
+
 @app.get("/")
 async def root():
     return {"message": "AWS Backend API is running with FastAPI changed BY ACTION By Action NEWWW   NEW 18"}
@@ -28,6 +45,7 @@ app.include_router(auth_router, prefix="/auth", tags=["authentication"])
 app.include_router(upload_router, prefix="/api", tags=["upload"])
 app.include_router(images_router, prefix="/api", tags=["images"])
 app.include_router(album_router, prefix="/api", tags=["albums"])
+app.include_router(search_router, prefix="/api", tags=["search"])
 
 
 @app.get("/api/health")
@@ -35,6 +53,11 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,110 +1,227 @@
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
 from pydantic import BaseModel
-import boto3
+import asyncio
 import os
-from auth.cognito_auth import get_cognito_credentials
+from typing import Optional
+from auth.context import AuthContext, get_auth_context
+from utils.aws_async import run_blocking
+from utils.s3_batch import delete_keys
+from utils.dynamodb_batch import batch_write, delete_requests
+from utils.derivatives import derivative_keys, THUMBNAIL_SIZE
+from utils import manifest, tag_index, user_version
+from routes.images import iter_manifest_pages, object_url, derivative_url
 
 router = APIRouter()
 
+DYNAMODB_TABLE = 'ImageLabels'
+ALBUM_DELETE_CONCURRENCY = int(os.getenv('ALBUM_DELETE_CONCURRENCY', '4'))
+
 class AlbumCreateRequest(BaseModel):
     albumName: str
     userId: str
 
 @router.get("/albums/{user_id}")
-async def list_albums(user_id: str, authorization: str = Header(None)):
+async def list_albums(user_id: str, auth: AuthContext = Depends(get_auth_context)):
     bucket_name = os.getenv("S3_BUCKET_NAME")
-    aws_region = os.getenv("AWS_REGION", "us-east-1")
     if not bucket_name:
         raise HTTPException(status_code=500, detail="Bucket S3 non configurato")
-    if not authorization or not authorization.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail="Token ID mancante")
-    id_token = authorization.split(' ')[1]
-    credentials = get_cognito_credentials(id_token)
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretKey'],
-        aws_session_token=credentials['SessionToken'],
-        region_name=aws_region
-    )
+    s3 = auth.s3
     prefix = f"users/{user_id}/"
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix, Delimiter="/")
         albums = []
-        # CommonPrefixes contiene le "cartelle" (album)
-        for cp in response.get('CommonPrefixes', []):
-            folder = cp.get('Prefix')
-            # Estraggo solo il nome album
-            parts = folder[len(prefix):].strip('/').split('/')
-            if parts and parts[0]:
-                albums.append(parts[0])
+        params = {'Bucket': bucket_name, 'Prefix': prefix, 'Delimiter': "/"}
+        # Tutte le pagine: ogni risposta contiene al massimo 1000 CommonPrefixes
+        while True:
+            response = await run_blocking(s3.list_objects_v2, **params)
+            # CommonPrefixes contiene le "cartelle" (album)
+            for cp in response.get('CommonPrefixes', []):
+                folder = cp.get('Prefix')
+                # Estraggo solo il nome album
+                parts = folder[len(prefix):].strip('/').split('/')
+                if parts and parts[0]:
+                    albums.append(parts[0])
+            token = response.get('NextContinuationToken')
+            if not token:
+                break
+            params['ContinuationToken'] = token
         return {"albums": albums}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore S3: {str(e)}")
 
 
+def _new_summary(album_name: str) -> dict:
+    return {"albumName": album_name, "imageCount": 0, "totalBytes": 0, "lastModified": None, "cover": None}
+
+
+async def summarize_albums(dynamodb, user_id: str) -> list:
+    """
+    Riepilogo degli album in un solo passaggio sulle pagine del manifest: per ogni
+    album numero di immagini, byte totali, ultima modifica e copertina (l'immagine
+    modificata più di recente). Solo gli aggregati restano in memoria, non le voci.
+    """
+    summaries = {}
+    # Derivate registrate della copertina di ogni album
+    cover_derivatives = {}
+    async for items, _ in iter_manifest_pages(dynamodb, user_id):
+        for item in items:
+            album_name = item.get('Album') or manifest.album_of(user_id, item['ImageKey'])
+            if not album_name:
+                continue
+            summary = summaries.setdefault(album_name, _new_summary(album_name))
+            # Marker dell'album o voce con i soli label della Lambda: nessuna immagine da contare
+            if item['ImageKey'].endswith('/') or 'Size' not in item:
+                continue
+            summary["imageCount"] += 1
+            summary["totalBytes"] += int(item['Size'])
+            # Date ISO 8601 in UTC: il confronto tra stringhe segue l'ordine temporale
+            last_modified = item.get('LastModified')
+            if last_modified and (summary["lastModified"] is None or last_modified > summary["lastModified"]):
+                summary["lastModified"] = last_modified
+                summary["cover"] = item['ImageKey']
+                cover_derivatives[album_name] = item.get('Derivatives')
+            elif summary["cover"] is None:
+                summary["cover"] = item['ImageKey']
+                cover_derivatives[album_name] = item.get('Derivatives')
+    for summary in summaries.values():
+        cover = summary["cover"]
+        summary["coverUrl"] = object_url(cover) if cover else None
+        summary["coverThumbnailUrl"] = (
+            derivative_url(cover, cover_derivatives.get(summary["albumName"]), THUMBNAIL_SIZE) if cover else None
+        )
+    return sorted(summaries.values(), key=lambda summary: summary["albumName"])
+
+
+@router.get("/albums/{user_id}/summary")
+async def album_summary(
+    user_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    auth: AuthContext = Depends(get_auth_context)
+):
+    try:
+        dynamodb = auth.dynamodb
+        version = await run_blocking(user_version.get_version, dynamodb, user_id)
+        headers = {
+            "ETag": user_version.make_etag(version, "album-summary", user_id),
+            "Cache-Control": "private, no-cache",
+            "Vary": "Authorization"
+        }
+        if user_version.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return {"albums": await summarize_albums(dynamodb, user_id)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore DynamoDB: {str(e)}")
+
+
 @router.post("/albums", status_code=status.HTTP_201_CREATED)
-async def create_album(data: AlbumCreateRequest, authorization: str = Header(None)):
+async def create_album(data: AlbumCreateRequest, auth: AuthContext = Depends(get_auth_context)):
     bucket_name = os.getenv("S3_BUCKET_NAME")
-    aws_region = os.getenv("AWS_REGION", "us-east-1")
     if not bucket_name:
         raise HTTPException(status_code=500, detail="Bucket S3 non configurato")
-    if not authorization or not authorization.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail="Token ID mancante")
-    id_token = authorization.split(' ')[1]
-    credentials = get_cognito_credentials(id_token)
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretKey'],
-        aws_session_token=credentials['SessionToken'],
-        region_name=aws_region
-    )
+    s3 = auth.s3
+    dynamodb = auth.dynamodb
     folder_key = f"users/{data.userId}/{data.albumName}/"
     try:
-        s3.put_object(Bucket=bucket_name, Key=folder_key)
+        await run_blocking(s3.put_object, Bucket=bucket_name, Key=folder_key)
+        await run_blocking(manifest.put_album, dynamodb, data.userId, data.albumName)
+        await user_version.touch(dynamodb, data.userId)
         return {"message": f"Album '{data.albumName}' creato per utente '{data.userId}'"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore S3: {str(e)}")
 
 
+async def _delete_album_objects(s3, dynamodb, bucket_name: str, user_id: str, folder_prefix: str):
+    """
+    Elimina l'album in pipeline: ogni pagina del listing diventa un batch DeleteObjects
+    (massimo 1000 chiavi) inviato mentre si legge la pagina successiva, con al massimo
+    ALBUM_DELETE_CONCURRENCY pagine in volo. Nello stesso passaggio vengono rimossi
+    le voci del manifest, i posting dell'indice dei tag, gli item ImageLabels e le
+    miniature delle chiavi eliminate.
+    Restituisce (numero di chiavi eliminate, {chiave: errore}).
+    """
+    semaphore = asyncio.Semaphore(ALBUM_DELETE_CONCURRENCY)
+
+    async def delete_page(keys: list):
+        try:
+            # Tag letti dal manifest prima che le voci vengano rimosse
+            removed = await tag_index.indexed_tags(dynamodb, user_id, [key for key in keys if not key.endswith('/')])
+            deleted, errors = await delete_keys(s3, bucket_name, keys)
+            await tag_index.reindex(dynamodb, user_id, removed={key: removed[key] for key in deleted if key in removed})
+            if deleted:
+                try:
+                    for key in await run_blocking(manifest.delete_entries, dynamodb, user_id, deleted):
+                        errors[key] = f"{manifest.MANIFEST_TABLE}: eliminazione non elaborata"
+                except Exception as e:
+                    print(f"Errore pulizia {manifest.MANIFEST_TABLE} per {folder_prefix}: {str(e)}")
+                    errors.update({key: f"{manifest.MANIFEST_TABLE}: {str(e)}" for key in deleted})
+            image_keys = [key for key in deleted if not key.endswith('/')]
+            if image_keys:
+                # Miniature: best effort, non compaiono negli errori dell'album
+                await delete_keys(s3, bucket_name, derivative_keys(image_keys))
+                try:
+                    failed = await run_blocking(
+                        batch_write,
+                        dynamodb,
+                        DYNAMODB_TABLE,
+                        delete_requests([{'ImageKey': {'S': key}} for key in image_keys])
+                    )
+                    for request in failed:
+                        key = request['DeleteRequest']['Key']['ImageKey']['S']
+                        errors[key] = f"{DYNAMODB_TABLE}: eliminazione non elaborata"
+                except Exception as e:
+                    print(f"Errore pulizia {DYNAMODB_TABLE} per {folder_prefix}: {str(e)}")
+                    errors.update({key: f"{DYNAMODB_TABLE}: {str(e)}" for key in image_keys})
+            return len(deleted), errors
+        finally:
+            semaphore.release()
+
+    tasks = []
+    params = {'Bucket': bucket_name, 'Prefix': folder_prefix}
+    try:
+        while True:
+            response = await run_blocking(s3.list_objects_v2, **params)
+            keys = [obj['Key'] for obj in response.get('Contents', [])]
+            if keys:
+                await semaphore.acquire()
+                tasks.append(asyncio.ensure_future(delete_page(keys)))
+            token = response.get('NextContinuationToken')
+            if not token:
+                break
+            params['ContinuationToken'] = token
+    finally:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    deleted_count = 0
+    errors = {}
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Errore eliminazione pagina di {folder_prefix}: {str(result)}")
+            errors[folder_prefix] = str(result)
+        else:
+            deleted_count += result[0]
+            errors.update(result[1])
+    return deleted_count, errors
+
+
 @router.delete("/albums/{album_name}/{user_id}", status_code=status.HTTP_200_OK)
-async def delete_album(album_name: str, user_id: str, authorization: str = Header(None)):
+async def delete_album(album_name: str, user_id: str, auth: AuthContext = Depends(get_auth_context)):
     bucket_name = os.getenv("S3_BUCKET_NAME")
-    aws_region = os.getenv("AWS_REGION", "us-east-1")
     if not bucket_name:
         raise HTTPException(status_code=500, detail="Bucket S3 non configurato")
-    if not authorization or not authorization.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail="Token ID mancante")
-    
-    id_token = authorization.split(' ')[1]
-    credentials = get_cognito_credentials(id_token)
-
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretKey'],
-        aws_session_token=credentials['SessionToken'],
-        region_name=aws_region
-    )
+
+    s3 = auth.s3
+    dynamodb = auth.dynamodb
 
     folder_prefix = f"users/{user_id}/{album_name}/"
     try:
-        paginator = s3.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=bucket_name, Prefix=folder_prefix)
-        all_keys = []
-        for page in pages:
-            for obj in page.get('Contents', []):
-                all_keys.append({'Key': obj['Key']})
-        if all_keys:
-            s3.delete_objects(Bucket=bucket_name, Delete={'Objects': all_keys})
-
-        try:
-            s3.delete_object(Bucket=bucket_name, Key=folder_prefix)
-        except Exception:
-            pass
-
-        return {"message": f"Album '{album_name}' eliminato per utente '{user_id}'"}
+        deleted, errors = await _delete_album_objects(s3, dynamodb, bucket_name, user_id, folder_prefix)
+        await user_version.touch(dynamodb, user_id)
+        return {
+            "message": f"Album '{album_name}' eliminato per utente '{user_id}'",
+            "deleted": deleted,
+            "errors": [{"key": key, "error": error} for key, error in errors.items()]
+        }
     except Exception as e:
         print("DELETE ALBUM ERROR:", e)
         raise HTTPException(status_code=500, detail=f"Errore S3: {str(e)}")
\ No newline at end of file
@@ -3,6 +3,7 @@ import os
 import requests
 import base64
 from pydantic import BaseModel
+from utils.aws_async import run_blocking
 
 router = APIRouter()
 
@@ -42,7 +43,7 @@ async def exchange_code_for_tokens(request: CodeExchangeRequest):
             'redirect_uri': request.redirect_uri
         }
         
-        response = requests.post(token_url, headers=headers, data=data)
+        response = await run_blocking(requests.post, token_url, headers=headers, data=data, timeout=10)
         
         if response.status_code != 200:
             if "invalid_grant" in response.text:
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, HTTPException, Header
-import boto3
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
 import os
+from typing import List, Optional
 from botocore.exceptions import ClientError
-from auth.cognito_auth import get_cognito_credentials
+from auth.context import AuthContext, get_auth_context
+from utils.aws_async import run_blocking, gather_bounded
+from utils.s3_batch import delete_keys
+from utils.dynamodb_batch import batch_write, delete_requests
+from utils.derivatives import derivative_key, derivative_keys, THUMBNAIL_SIZE, PREVIEW_SIZE
+from utils import manifest, tag_index, user_version
+from utils.json_response import dumps
 
 router = APIRouter()
 
@@ -11,151 +18,264 @@ IDENTITY_POOL_ID = os.getenv('IDENTITY_POOL_ID')
 USER_POOL_ID = os.getenv('USER_POOL_ID')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 DYNAMODB_TABLE = 'ImageLabels'
+USER_INDEX = 'UserIdIndex'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+MOVE_COPY_CONCURRENCY = int(os.getenv('MOVE_COPY_CONCURRENCY', '16'))
 
 
-def get_image_tags(dynamodb_client, user_id: str, filename: str):
+def parse_image_tags(item: dict) -> list:
+    # Estrai i tag da 'LabelNames' se presente, altrimenti da 'Labels'
+    tags = []
+    if 'LabelNames' in item:
+        labelnames = item['LabelNames']['L']
+        tags = [label['S'] for label in labelnames if isinstance(label, dict) and 'S' in label]
+    elif 'Labels' in item:
+        labels = item['Labels']['L']
+        for label in labels:
+            if 'M' in label and 'Name' in label['M'] and 'S' in label['M']['Name']:
+                tags.append(label['M']['Name']['S'])
+            elif 'S' in label:
+                tags.append(label['S'])
+    return tags
+
+
+async def delete_label_items(dynamodb_client, image_keys: list):
+    """
+    Rimuove gli item ImageLabels delle chiavi eliminate o spostate: altrimenti i
+    loro tag resterebbero nei conteggi di /tags (la copia spostata riceve un item
+    nuovo dalla Lambda). Best effort: gli errori vengono solo registrati.
+    """
+    if not image_keys:
+        return
     try:
-        image_key = f"users/{user_id}/{filename}"
-        response = dynamodb_client.get_item(
-            TableName=DYNAMODB_TABLE,
-            Key={
-                'ImageKey': {'S': image_key}
-            }
+        failed = await run_blocking(
+            batch_write,
+            dynamodb_client,
+            DYNAMODB_TABLE,
+            delete_requests([{'ImageKey': {'S': key}} for key in image_keys])
         )
-        # Estrai i tag da 'LabelNames' se presente, altrimenti da 'Labels'
-        item = response.get('Item', {})
-        tags = []
-        if 'LabelNames' in item:
-            labelnames = item['LabelNames']['L']
-            tags = [label['S'] for label in labelnames if isinstance(label, dict) and 'S' in label]
-        elif 'Labels' in item:
-            labels = item['Labels']['L']
-            for label in labels:
-                if 'M' in label and 'Name' in label['M'] and 'S' in label['M']['Name']:
-                    tags.append(label['M']['Name']['S'])
-        return tags
+        for request in failed:
+            print(f"Item {DYNAMODB_TABLE} non rimosso per {request['DeleteRequest']['Key']['ImageKey']['S']}")
+    except Exception as e:
+        print(f"Errore pulizia {DYNAMODB_TABLE}: {str(e)}")
+
+
+async def iter_manifest_pages(dynamodb_client, user_id: str, page_size: Optional[int] = None, cursor: Optional[str] = None):
+    """Itera le pagine del manifest dell'utente come coppie (items, next_cursor)."""
+    while True:
+        items, cursor = await run_blocking(manifest.query_page, dynamodb_client, user_id, page_size, cursor)
+        yield items, cursor
+        if not cursor:
+            return
+
+
+async def list_manifest_items(dynamodb_client, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Elenca le voci del manifest dell'utente. Con `limit` o `cursor` legge una sola
+    pagina e restituisce il cursore successivo; altrimenti legge tutte le pagine.
+    Restituisce (items, next_cursor).
+    """
+    if limit or cursor:
+        async for page, next_cursor in iter_manifest_pages(dynamodb_client, user_id, limit, cursor):
+            return page, next_cursor
+
+    items = []
+    async for page, _ in iter_manifest_pages(dynamodb_client, user_id):
+        items.extend(page)
+    return items, None
+
+
+async def stream_image_records(dynamodb_client, user_id: str, cursor: Optional[str] = None):
+    """
+    Genera un record JSON per riga (NDJSON) man mano che arrivano le pagine del
+    manifest, senza tenere in memoria l'intero catalogo.
+    """
+    try:
+        async for items, _ in iter_manifest_pages(dynamodb_client, user_id, cursor=cursor):
+            images, _ = manifest_image_records(user_id, items)
+            for image in images:
+                yield dumps(image) + b"\n"
     except Exception as e:
-        print(f"Errore in get_image_tags: {str(e)}")
-        return []
+        # Lo status è già stato inviato: segnala l'interruzione con una riga di errore
+        print(f"Errore durante lo streaming delle immagini: {str(e)}")
+        yield dumps({"error": str(e)}) + b"\n"
+
+
+def object_url(key: str) -> str:
+    return f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
+
+
+def derivative_url(key: str, derivatives, size: int) -> Optional[str]:
+    """URL della miniatura WebP solo se la Lambda l'ha registrata (attributo Derivatives del manifest)."""
+    if size not in {int(created) for created in derivatives or []}:
+        return None
+    return object_url(derivative_key(key, size))
 
-    
 
+def image_record(user_id: str, key: str, size: int, last_modified: str, tags: list, metadata: dict,
+                 derivatives: Optional[list] = None) -> dict:
+    return {
+        "name": key.split('/')[-1],
+        "filename": key,
+        "url": object_url(key),
+        # Miniature WebP generate dalla Lambda: se mancano (None) il client usa url
+        "thumbnail_url": derivative_url(key, derivatives, THUMBNAIL_SIZE),
+        "preview_url": derivative_url(key, derivatives, PREVIEW_SIZE),
+        "size": size,
+        "last_modified": last_modified,
+        "tags": tags,
+        "owner": user_id,
+        "metadata": metadata
+    }
+
+
+def group_albums(user_id: str, album_keys: list, images: list) -> dict:
+    """Raggruppa le immagini per album: {album: [immagini]}, inclusi gli album vuoti."""
+    prefix = f"users/{user_id}/"
+    albums = {}
+    for key in album_keys:
+        album_name = key[len(prefix):].strip('/')
+        if album_name:
+            albums.setdefault(album_name, [])
+    for image in images:
+        parts = image['filename'][len(prefix):].split('/')
+        if len(parts) > 1:
+            albums.setdefault(parts[0], []).append(image)
+    return albums
+
+
+def manifest_image_records(user_id: str, items: list):
+    """
+    Costruisce gli oggetti immagine e il raggruppamento per album da una pagina del
+    manifest, senza altre letture. Restituisce (images, albums).
+    """
+    images = []
+    album_keys = []
+    for item in items:
+        key = item['ImageKey']
+        if key.endswith('/'):
+            album_keys.append(key)
+            continue
+        # Solo LabelNames: la Lambda ha scritto i label ma l'upload non è (più) registrato
+        if 'Size' not in item:
+            continue
+        images.append(image_record(
+            user_id, key, int(item['Size']), item.get('LastModified'),
+            item.get('LabelNames', []), item.get('Metadata', {}), item.get('Derivatives')
+        ))
+    return images, group_albums(user_id, album_keys, images)
 
 
 @router.get("/images/{user_id}")
-async def get_user_images(user_id: str, authorization: str = Header(None)):
+async def get_user_images(
+    user_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    # ref: gli album contengono solo le chiavi (filename) invece di copie delle immagini
+    album_format: str = Query("full", pattern="^(full|ref)$"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    auth: AuthContext = Depends(get_auth_context)
+):
     try:
-        if not authorization or not authorization.startswith('Bearer '):
-            raise HTTPException(status_code=401, detail="Token ID mancante")
-        id_token = authorization.split(' ')[1]
-        credentials = get_cognito_credentials(id_token)
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretKey'],
-            aws_session_token=credentials['SessionToken'],
-            region_name=AWS_REGION
-        )
-        dynamodb_client = boto3.client(
-            'dynamodb',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretKey'],
-            aws_session_token=credentials['SessionToken'],
-            region_name=AWS_REGION
-        )
+        dynamodb_client = auth.dynamodb
         if not BUCKET_NAME:
             raise HTTPException(status_code=500, detail="S3_BUCKET_NAME non configurato")
-        response = s3_client.list_objects_v2(
-            Bucket=BUCKET_NAME,
-            Prefix=f"users/{user_id}/"
-        )
+        if cursor:
+            try:
+                manifest.decode_cursor(user_id, cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
-        images = []
-        albums = {}
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                key = obj['Key']
-                if key.endswith('/'):
-                    album_name = key[len(f"users/{user_id}/"):].strip('/')
-                    if album_name:
-                        albums[album_name] = []
-                    continue
-                image_url = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{key}"
-                filename = key.split('/')[-1]
-                tags = get_image_tags(dynamodb_client, user_id, filename)
-                metadata = {}
-                try:
-                    head = s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
-                    metadata = head.get('Metadata', {})
-                except Exception as meta_err:
-                    print(f"Errore recupero metadata per {key}: {meta_err}")
-                image_obj = {
-                    "name": filename,
-                    "filename": key,
-                    "url": image_url,
-                    "size": obj['Size'],
-                    "last_modified": obj['LastModified'].isoformat(),
-                    "tags": tags,
-                    "owner": user_id,
-                    "metadata": metadata
-                }
-                images.append(image_obj)
-                # Raggruppa per album
-                parts = key[len(f"users/{user_id}/"):].split('/')
-                if len(parts) > 1:
-                    album = parts[0]
-                    if album not in albums:
-                        albums[album] = []
-                    albums[album].append(image_obj)
-        # Costruisci la risposta
+        # Versione letta prima del listing: una modifica concorrente produce un ETag nuovo
+        streaming = bool(accept and NDJSON_MEDIA_TYPE in accept)
+        version = await run_blocking(user_version.get_version, dynamodb_client, user_id)
+        headers = {
+            "ETag": user_version.make_etag(version, "images", user_id, limit, cursor, album_format, streaming),
+            "Cache-Control": "private, no-cache",
+            "Vary": "Authorization, Accept"
+        }
+        if user_version.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+        # Modalità streaming per export/sync dell'intero catalogo
+        if streaming:
+            return StreamingResponse(
+                stream_image_records(dynamodb_client, user_id, cursor),
+                media_type=NDJSON_MEDIA_TYPE,
+                headers=headers
+            )
+        response.headers.update(headers)
+
+        # Una Query paginata sul manifest: nessun listing S3, HEAD o lettura dei tag
+        items, next_cursor = await list_manifest_items(dynamodb_client, user_id, limit, cursor)
+        images, albums = manifest_image_records(user_id, items)
+
+        # Costruisci la risposta. Con la paginazione ogni pagina contiene solo gli
+        # album delle proprie immagini: il client li unisce per albumName.
         return {
             "images": images,
             "album": [
                 {
                     "albumName": album,
-                    "images": imgs
+                    "images": [img["filename"] for img in imgs] if album_format == "ref" else imgs
                 } for album, imgs in albums.items()
-            ]
+            ],
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except ClientError as e:
-        raise HTTPException(status_code=500, detail=f"Errore S3: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Errore DynamoDB: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore durante il recupero: {str(e)}")
 
 @router.get("/tags/{user_id}")
-async def get_user_tags(user_id: str, authorization: str = Header(None)):
+async def get_user_tags(
+    user_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    auth: AuthContext = Depends(get_auth_context)
+):
     try:
-        if not authorization or not authorization.startswith('Bearer '):
-            raise HTTPException(status_code=401, detail="Token ID mancante")
-        
-        id_token = authorization.split(' ')[1]
-        
-        credentials = get_cognito_credentials(id_token)
-        
-        dynamodb_client = boto3.client(
-            'dynamodb',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretKey'],
-            aws_session_token=credentials['SessionToken'],
-            region_name=AWS_REGION
-        )
+        dynamodb_client = auth.dynamodb
+
+        # La Lambda incrementa la versione quando scrive nuovi label
+        version = await run_blocking(user_version.get_version, dynamodb_client, user_id)
+        headers = {
+            "ETag": user_version.make_etag(version, "tags", user_id),
+            "Cache-Control": "private, no-cache",
+            "Vary": "Authorization"
+        }
+        if user_version.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
         
-        response = dynamodb_client.scan(
-            TableName=DYNAMODB_TABLE,
-            FilterExpression='UserId = :user_id',
-            ExpressionAttributeValues={
+        # Query sull'indice per utente: legge solo gli item di questo utente, tutte le pagine
+        tag_counts = {}
+        params = {
+            'TableName': DYNAMODB_TABLE,
+            'IndexName': USER_INDEX,
+            'KeyConditionExpression': '#user = :user_id',
+            'ProjectionExpression': '#names, #labels',
+            'ExpressionAttributeNames': {
+                '#user': 'UserId',
+                '#names': 'LabelNames',
+                '#labels': 'Labels'
+            },
+            'ExpressionAttributeValues': {
                 ':user_id': {'S': user_id}
             }
-        )
-        
-        tag_counts = {}
-        
-        for item in response['Items']:
-            if 'Labels' in item:
-                labels = item['Labels']['L']
-                for label in labels:
-                    tag = label['S']
+        }
+        while True:
+            page = await run_blocking(dynamodb_client.query, **params)
+            for item in page.get('Items', []):
+                for tag in parse_image_tags(item):
                     tag_counts[tag] = tag_counts.get(tag, 0) + 1
+            if 'LastEvaluatedKey' not in page:
+                break
+            params['ExclusiveStartKey'] = page['LastEvaluatedKey']
         
         tags = [{"tag": tag, "count": count} for tag, count in tag_counts.items()]
         tags.sort(key=lambda x: x['count'], reverse=True)
@@ -168,23 +288,20 @@ async def get_user_tags(user_id: str, authorization: str = Header(None)):
         raise HTTPException(status_code=500, detail=f"Errore durante il recupero tag: {str(e)}")
 
 @router.delete("/images/{user_id}/{filename}")
-async def delete_user_image(user_id: str, filename: str, authorization: str = Header(None)):
+async def delete_user_image(user_id: str, filename: str, auth: AuthContext = Depends(get_auth_context)):
     try:
-        if not authorization or not authorization.startswith('Bearer '):
-            raise HTTPException(status_code=401, detail="Token ID mancante")
-        id_token = authorization.split(' ')[1]
-        credentials = get_cognito_credentials(id_token)
-
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretKey'],
-            aws_session_token=credentials['SessionToken'],
-            region_name=AWS_REGION
-        )
+        s3_client = auth.s3
+        dynamodb_client = auth.dynamodb
 
         key = f"users/{user_id}/{filename}"
-        s3_client.delete_object(Bucket=BUCKET_NAME, Key=key)
+        removed = await tag_index.indexed_tags(dynamodb_client, user_id, [key])
+        await run_blocking(s3_client.delete_object, Bucket=BUCKET_NAME, Key=key)
+        await run_blocking(manifest.delete_entries, dynamodb_client, user_id, [key])
+        await tag_index.reindex(dynamodb_client, user_id, removed=removed)
+        await delete_label_items(dynamodb_client, [key])
+        await user_version.touch(dynamodb_client, user_id)
+        # Le miniature orfane non sono un errore per il client
+        await delete_keys(s3_client, BUCKET_NAME, derivative_keys([key]))
         return {"message": "Image deleted successfully", "filename": key}
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"Errore S3: {str(e)}")
@@ -195,40 +312,145 @@ async def delete_user_image(user_id: str, filename: str, authorization: str = He
 # API per spostare un'immagine tra album
 from pydantic import BaseModel
 
+async def register_moved_image(s3_client, dynamodb_client, user_id: str, source_key: str, target_key: str, last_modified: str) -> dict:
+    """
+    Registra nel manifest la copia spostata riusando la voce della sorgente (metadata
+    e label); se la sorgente non è nel manifest i dati vengono letti con una HEAD.
+    Restituisce i tag indicizzati dell'immagine ({tag: confidenza}).
+    """
+    entry = await run_blocking(manifest.get_entry, dynamodb_client, user_id, source_key)
+    if entry and 'Size' in entry:
+        size, metadata, etag = int(entry['Size']), entry.get('Metadata', {}), entry.get('ETag')
+        label_names, labels = entry.get('LabelNames'), entry.get('Labels')
+        tags = tag_index.entry_tags(entry)
+    else:
+        head = await run_blocking(s3_client.head_object, Bucket=BUCKET_NAME, Key=target_key)
+        size, metadata, etag = head['ContentLength'], head.get('Metadata', {}), head.get('ETag')
+        label_names, labels = None, None
+        tags = tag_index.user_tags(metadata.get('tags'))
+    await run_blocking(
+        manifest.put_image, dynamodb_client, user_id, target_key, size, last_modified, metadata, etag,
+        label_names, labels
+    )
+    return tags
+
 class MoveImageRequest(BaseModel):
     userId: str
     filename: str
     targetAlbum: str
 
 @router.post("/images/move")
-async def move_image_to_album(data: MoveImageRequest, authorization: str = Header(None)):
+async def move_image_to_album(data: MoveImageRequest, auth: AuthContext = Depends(get_auth_context)):
     try:
-        if not authorization or not authorization.startswith('Bearer '):
-            raise HTTPException(status_code=401, detail="Token ID mancante")
-        id_token = authorization.split(' ')[1]
-        credentials = get_cognito_credentials(id_token)
-
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretKey'],
-            aws_session_token=credentials['SessionToken'],
-            region_name=AWS_REGION
-        )
+        s3_client = auth.s3
+        dynamodb_client = auth.dynamodb
 
         source_key = f"users/{data.userId}/{data.filename}"
         target_key = f"users/{data.userId}/{data.targetAlbum}/{data.filename}"
 
         
-        s3_client.copy_object(
+        copy = await run_blocking(
+            s3_client.copy_object,
             Bucket=BUCKET_NAME,
             CopySource={"Bucket": BUCKET_NAME, "Key": source_key},
             Key=target_key
         )
-        s3_client.delete_object(Bucket=BUCKET_NAME, Key=source_key)
+        tags = await register_moved_image(
+            s3_client, dynamodb_client, data.userId, source_key, target_key,
+            copy['CopyObjectResult']['LastModified'].isoformat()
+        )
+        await run_blocking(s3_client.delete_object, Bucket=BUCKET_NAME, Key=source_key)
+        await run_blocking(manifest.delete_entries, dynamodb_client, data.userId, [source_key])
+        await tag_index.reindex(dynamodb_client, data.userId, added={target_key: tags}, removed={source_key: list(tags)})
+        await delete_label_items(dynamodb_client, [source_key])
+        await user_version.touch(dynamodb_client, data.userId)
+        # Le miniature della destinazione vengono generate dalla Lambda sulla copia
+        await delete_keys(s3_client, BUCKET_NAME, derivative_keys([source_key]))
 
         return {"message": "Immagine spostata con successo", "filename": data.filename, "targetAlbum": data.targetAlbum}
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"Errore S3: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Errore durante lo spostamento: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Errore durante lo spostamento: {str(e)}")
+
+class BulkMoveImagesRequest(BaseModel):
+    userId: str
+    filenames: List[str]
+    targetAlbum: str
+
+@router.post("/images/move/bulk")
+async def move_images_to_album(data: BulkMoveImagesRequest, auth: AuthContext = Depends(get_auth_context)):
+    """
+    Sposta più immagini in un album: le copie server-side procedono in parallelo
+    (massimo MOVE_COPY_CONCURRENCY), poi le sorgenti copiate vengono eliminate con
+    DeleteObjects a blocchi da 1000. Restituisce l'esito per ogni immagine.
+    """
+    try:
+        s3_client = auth.s3
+        dynamodb_client = auth.dynamodb
+
+        async def copy_one(filename: str):
+            source_key = f"users/{data.userId}/{filename}"
+            target_key = f"users/{data.userId}/{data.targetAlbum}/{filename}"
+            copy = await run_blocking(
+                s3_client.copy_object,
+                Bucket=BUCKET_NAME,
+                CopySource={"Bucket": BUCKET_NAME, "Key": source_key},
+                Key=target_key
+            )
+            tags = await register_moved_image(
+                s3_client, dynamodb_client, data.userId, source_key, target_key,
+                copy['CopyObjectResult']['LastModified'].isoformat()
+            )
+            return source_key, target_key, tags
+
+        filenames = list(dict.fromkeys(data.filenames))
+        copies = await gather_bounded(
+            MOVE_COPY_CONCURRENCY,
+            *(copy_one(filename) for filename in filenames),
+            return_exceptions=True
+        )
+
+        results = {}
+        copied = {}
+        moved_tags = {}
+        for filename, copy in zip(filenames, copies):
+            if isinstance(copy, Exception):
+                results[filename] = {"filename": filename, "status": "error", "error": f"Copia fallita: {str(copy)}"}
+            else:
+                source_key, target_key, tags = copy
+                copied[source_key] = filename
+                moved_tags[source_key] = (target_key, tags)
+
+        # Le sorgenti vengono rimosse solo se la copia è riuscita
+        deleted, errors = await delete_keys(s3_client, BUCKET_NAME, list(copied))
+        for source_key in deleted:
+            filename = copied[source_key]
+            results[filename] = {"filename": filename, "status": "moved"}
+        for source_key, error in errors.items():
+            filename = copied[source_key]
+            results[filename] = {"filename": filename, "status": "error", "error": f"Eliminazione sorgente fallita: {error}"}
+        await delete_keys(s3_client, BUCKET_NAME, derivative_keys(deleted))
+        for source_key in await run_blocking(manifest.delete_entries, dynamodb_client, data.userId, deleted):
+            print(f"Voce manifest non rimossa per {source_key}")
+        # Anche le copie con sorgente non eliminata sono nel manifest: vanno indicizzate
+        await tag_index.reindex(
+            dynamodb_client, data.userId,
+            added={target_key: tags for target_key, tags in moved_tags.values()},
+            removed={source_key: list(moved_tags[source_key][1]) for source_key in deleted}
+        )
+        await delete_label_items(dynamodb_client, deleted)
+        if copied:
+            await user_version.touch(dynamodb_client, data.userId)
+
+        moved = sum(1 for result in results.values() if result["status"] == "moved")
+        return {
+            "targetAlbum": data.targetAlbum,
+            "results": [results[filename] for filename in filenames],
+            "moved": moved,
+            "failed": len(filenames) - moved
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore durante lo spostamento: {str(e)}")
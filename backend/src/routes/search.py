@@ -0,0 +1,119 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+import os
+from typing import List, Optional
+from botocore.exceptions import ClientError
+from auth.context import AuthContext, get_auth_context
+from utils.aws_async import run_blocking, gather_bounded
+from utils import manifest, tag_index, user_version
+from routes.images import manifest_image_records
+
+router = APIRouter()
+
+SEARCH_MAX_TAGS = int(os.getenv('SEARCH_MAX_TAGS', '10'))
+SEARCH_QUERY_CONCURRENCY = int(os.getenv('SEARCH_QUERY_CONCURRENCY', '4'))
+
+
+def decode_offset(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    if not cursor.isdigit():
+        raise ValueError("Cursore non valido")
+    return int(cursor)
+
+
+def rank_postings(postings: list, mode: str) -> list:
+    """
+    Combina i posting dei tag cercati: "and" tiene le immagini presenti in tutti,
+    "or" in almeno uno. Il punteggio è la somma delle confidenze dei tag trovati.
+    Restituisce [(ImageKey, punteggio)] dal punteggio più alto.
+    """
+    keys = set(postings[0]) if postings else set()
+    for tag_postings in postings[1:]:
+        keys = keys & set(tag_postings) if mode == "and" else keys | set(tag_postings)
+    scores = {key: sum(tag_postings.get(key, 0) for tag_postings in postings) for key in keys}
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+@router.get("/search/{user_id}")
+async def search_images(
+    user_id: str,
+    response: Response,
+    tags: List[str] = Query(...),
+    mode: str = Query("and", pattern="^(and|or)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    auth: AuthContext = Depends(get_auth_context)
+):
+    """
+    Ricerca per tag sull'indice invertito (ImageTagIndex): una Query per tag,
+    poi solo le immagini della pagina vengono lette dal manifest.
+    """
+    try:
+        dynamodb_client = auth.dynamodb
+        # Anche "a,b" nello stesso parametro vale come due tag
+        terms = list(dict.fromkeys(
+            tag_index.normalize_tag(term) for tag in tags for term in tag.split(',') if term.strip()
+        ))
+        if not terms:
+            raise HTTPException(status_code=400, detail="Nessun tag da cercare")
+        if len(terms) > SEARCH_MAX_TAGS:
+            raise HTTPException(status_code=400, detail=f"Massimo {SEARCH_MAX_TAGS} tag per ricerca")
+        try:
+            offset = decode_offset(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        version = await run_blocking(user_version.get_version, dynamodb_client, user_id)
+        headers = {
+            "ETag": user_version.make_etag(version, "search", user_id, sorted(terms), mode, limit, offset),
+            "Cache-Control": "private, no-cache",
+            "Vary": "Authorization"
+        }
+        if user_version.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+        postings = await gather_bounded(
+            SEARCH_QUERY_CONCURRENCY,
+            *(run_blocking(tag_index.query_postings, dynamodb_client, user_id, term) for term in terms)
+        )
+        ranked = rank_postings(postings, mode)
+        page = ranked[offset:offset + limit]
+
+        entries = await run_blocking(manifest.get_entries, dynamodb_client, user_id, [key for key, _ in page])
+        # Posting di immagini non più nel manifest (eliminazioni concorrenti): scartati
+        images, _ = manifest_image_records(user_id, [entries[key] for key, _ in page if key in entries])
+        scores = dict(page)
+        for image in images:
+            image["score"] = scores[image["filename"]]
+
+        next_offset = offset + limit
+        return {
+            "images": images,
+            "total": len(ranked),
+            "next_cursor": str(next_offset) if next_offset < len(ranked) else None
+        }
+    except HTTPException:
+        raise
+    except ClientError as e:
+        raise HTTPException(status_code=500, detail=f"Errore DynamoDB: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore durante la ricerca: {str(e)}")
+
+
+@router.get("/tags/{user_id}/suggest")
+async def suggest_tags(
+    user_id: str,
+    prefix: str = Query("", max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    auth: AuthContext = Depends(get_auth_context)
+):
+    """Autocompletamento: tag dell'utente che iniziano con il prefisso, dal più usato."""
+    try:
+        suggestions = await run_blocking(tag_index.suggest, auth.dynamodb, user_id, prefix, limit)
+        return {"suggestions": suggestions}
+    except ClientError as e:
+        raise HTTPException(status_code=500, detail=f"Errore DynamoDB: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Errore durante il recupero tag: {str(e)}")
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form, Header
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form
 from fastapi.responses import JSONResponse
-import boto3
+from pydantic import BaseModel
 import os
-import botocore
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import uuid
-from typing import Optional
-from auth.routes import get_current_user
-from auth.cognito_auth import get_temporary_credentials
-from jose import jwt
+from typing import List, Optional
+from utils.aws_async import run_blocking, gather_bounded
+from utils.s3_multipart import stream_upload
+from utils.s3_batch import delete_keys
+from utils.derivatives import derivative_keys
+from utils import manifest, tag_index, user_version
+from auth.context import AuthContext, get_auth_context
+from routes.images import delete_label_items
 import datetime
 
 # Carica le variabili d'ambiente
@@ -20,91 +23,30 @@ router = APIRouter()
 # Configurazione
 AWS_REGION = os.environ.get('AWS_REGION')
 BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+PRESIGNED_UPLOAD_EXPIRES = int(os.environ.get('PRESIGNED_UPLOAD_EXPIRES', '900'))
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get('BATCH_UPLOAD_CONCURRENCY', '4'))
 
-def get_s3_client(id_token: str = None, authorization: Optional[str] = Header(None)):
-    """
-    Ottiene un client S3 autenticato con credenziali temporanee Cognito.
-    - Usa l'id_token passato o lo estrae dall'header Authorization.
-    - Verifica che il token sia un ID token Cognito.
-    - Logga il payload JWT per debug.
-    - Solleva HTTPException 401 se il token non è valido.
-    """
-    # Estrai il token JWT
-    token = id_token
-    if not token and authorization:
-        if authorization.startswith('Bearer '):
-            token = authorization.replace('Bearer ', '')
-    if not token:
-        raise HTTPException(status_code=401, detail="Token di autenticazione non fornito")
-
-    # Decodifica e verifica il token
-    try:
-        decoded = jwt.decode(
-            token,
-            key="",
-            options={
-                "verify_signature": False,
-                "verify_aud": False,
-                "verify_at_hash": False
-            }
-        )
-        print(f"DEBUG JWT PAYLOAD (get_s3_client): {decoded}")
-        token_use = decoded.get("token_use")
-        aud = decoded.get("aud")
-        if token_use != "id":
-            print("⚠️  Il token fornito NON è un ID token Cognito. Serve l'ID token, non l'access token.")
-            raise HTTPException(status_code=401, detail="Il token fornito non è un ID token Cognito.")
-    except Exception as e:
-        print(f"Impossibile decodificare il token JWT: {str(e)}")
-        raise HTTPException(status_code=401, detail=f"Token JWT non valido: {str(e)}")
+class PresignUploadRequest(BaseModel):
+    filename: str
+    contentType: str
+    size: int
+    name: Optional[str] = None
+    tags: Optional[str] = None
+    userId: Optional[str] = None
 
-    # Ottieni credenziali temporanee AWS tramite Cognito
-    credentials = get_temporary_credentials(token)
-    if not credentials or not credentials.get('AccessKeyId'):
-        print(f"Credenziali temporanee non ottenute. Risposta: {credentials}")
-        raise HTTPException(status_code=401, detail="Credenziali AWS temporanee non ottenute. Effettua nuovamente il login.")
+class CompleteUploadRequest(BaseModel):
+    filename: str
+    userId: Optional[str] = None
 
-    # Crea e restituisci il client S3 autenticato
-    try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretKey'],
-            aws_session_token=credentials['SessionToken'],
-            region_name=AWS_REGION,
-            config=botocore.config.Config(
-                signature_version='s3v4',
-                retries={'max_attempts': 3}
-            )
-        )
-        return s3_client
-    except Exception as e:
-        print(f"Errore nella creazione del client S3: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Errore di configurazione S3: {str(e)}")
-
-def extract_id_token(authorization: Optional[str]) -> Optional[str]:
-    if authorization and authorization.startswith('Bearer '):
-        return authorization.replace('Bearer ', '')
-    return os.environ.get("TEMP_ID_TOKEN")
-
-def extract_user_id(id_token: str) -> Optional[str]:
-    try:
-        decoded = jwt.decode(id_token, key="", options={"verify_signature": False})
-        if decoded.get("token_use") != "id":
-            raise ValueError("Il token fornito non è un ID token Cognito.")
-        return decoded.get('cognito:username') or decoded.get('sub')
-    except Exception as e:
-        print(f"Errore estrazione userId dal token: {str(e)}")
-        return None
-
-def generate_s3_key(user_id: Optional[str], file: UploadFile) -> str:
-    file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'bin'
+def generate_s3_key(user_id: Optional[str], filename: str) -> str:
+    file_extension = filename.split('.')[-1] if '.' in filename else 'bin'
     s3_folder = f"users/{user_id}" if user_id else "user/anonymous"
     return f"{s3_folder}/{uuid.uuid4().hex}.{file_extension}"
 
-def build_metadata(file: UploadFile, display_name: str, tags: Optional[str], user_id: Optional[str]) -> dict:
+def build_metadata(filename: str, display_name: str, tags: Optional[str], user_id: Optional[str]) -> dict:
     metadata = {
-        'originalname': file.filename,
+        'originalname': filename,
         'displayname': display_name,
         'upload_date': datetime.datetime.utcnow().isoformat(),
         'download_count': '0'
@@ -115,70 +57,232 @@ def build_metadata(file: UploadFile, display_name: str, tags: Optional[str], use
         metadata['userid'] = str(user_id)
     return metadata
 
+def upload_owner(auth: AuthContext, requested_user_id: Optional[str]) -> str:
+    """
+    Proprietario dell'upload: sempre l'utente del token. Uno userId nel body è
+    ammesso solo se coincide, altrimenti si potrebbe scrivere nella partizione altrui.
+    """
+    if not auth.user_id:
+        raise HTTPException(status_code=401, detail="UserId non trovato nel token")
+    if requested_user_id and requested_user_id != auth.user_id:
+        raise HTTPException(status_code=403, detail="UserId non corrisponde al token")
+    return auth.user_id
+
+async def store_upload(s3_client, dynamodb_client, file: UploadFile, user_id: str, name: Optional[str], tags: Optional[str]) -> dict:
+    """Carica un singolo file su S3, lo registra nel manifest e restituisce il payload di risposta."""
+    display_name = name or file.filename
+    unique_filename = generate_s3_key(user_id, file.filename)
+    metadata = build_metadata(file.filename, display_name, tags, user_id)
+
+    # Streaming dallo spool di UploadFile verso S3, senza caricare il file in memoria
+    size = await stream_upload(s3_client, file, BUCKET_NAME, unique_filename, file.content_type, metadata)
+    await run_blocking(
+        manifest.put_image, dynamodb_client, user_id, unique_filename, size,
+        datetime.datetime.now(datetime.timezone.utc).isoformat(), metadata
+    )
+    # I label Rekognition vengono indicizzati dalla Lambda, qui solo i tag utente
+    await tag_index.reindex(dynamodb_client, user_id, added={unique_filename: tag_index.user_tags(tags)})
+    image_url = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{unique_filename}"
+
+    return {
+        "message": "Image uploaded successfully",
+        "url": image_url,
+        "filename": unique_filename,
+        "name": display_name,
+        "tags": tags.split(',') if tags else []
+    }
+
 @router.post("/upload")
 async def upload_image(
     file: UploadFile = File(...), 
     name: Optional[str] = Form(None), 
     tags: Optional[str] = Form(None), 
     userId: Optional[str] = Form(None),
-    authorization: Optional[str] = Header(None)
+    auth: AuthContext = Depends(get_auth_context)
+):
+    try:
+        user_id = upload_owner(auth, userId)
+
+        s3_client = auth.s3
+        dynamodb_client = auth.dynamodb
+        result = await store_upload(s3_client, dynamodb_client, file, user_id, name, tags)
+        await user_version.touch(dynamodb_client, user_id)
+        return JSONResponse(result)
+
+    except HTTPException:
+        raise
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', '')
+        error_msg = e.response.get('Error', {}).get('Message', '')
+        print(f"AWS S3 error: {error_code} - {error_msg}")
+        raise HTTPException(status_code=500, detail=f"AWS S3 error: {error_code} - {error_msg}")
+    except Exception as e:
+        print(f"Errore durante l'upload: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
+
+@router.post("/upload/batch")
+async def upload_images_batch(
+    files: List[UploadFile] = File(...),
+    tags: Optional[str] = Form(None),
+    userId: Optional[str] = Form(None),
+    auth: AuthContext = Depends(get_auth_context)
 ):
+    """
+    Carica più file in una sola richiesta: token e credenziali vengono risolti una
+    volta, gli upload procedono in parallelo (massimo BATCH_UPLOAD_CONCURRENCY) e
+    ogni file ha il proprio esito, così un fallimento parziale non richiede di ripetere tutto.
+    """
+    user_id = upload_owner(auth, userId)
+
+    s3_client = auth.s3
+    dynamodb_client = auth.dynamodb
+
+    async def upload_one(file: UploadFile) -> dict:
+        try:
+            result = await store_upload(s3_client, dynamodb_client, file, user_id, None, tags)
+            return {"originalname": file.filename, "status": "uploaded", **result}
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', '')
+            error_msg = e.response.get('Error', {}).get('Message', '')
+            print(f"AWS S3 error ({file.filename}): {error_code} - {error_msg}")
+            return {"originalname": file.filename, "status": "error", "error": f"AWS S3 error: {error_code} - {error_msg}"}
+        except Exception as e:
+            print(f"Errore durante l'upload di {file.filename}: {str(e)}")
+            return {"originalname": file.filename, "status": "error", "error": f"Upload error: {str(e)}"}
+
+    results = await gather_bounded(BATCH_UPLOAD_CONCURRENCY, *(upload_one(file) for file in files))
+    uploaded = sum(1 for result in results if result["status"] == "uploaded")
+    # Una sola nuova versione per l'intero batch
+    if uploaded:
+        await user_version.touch(dynamodb_client, user_id)
+
+    return JSONResponse({
+        "results": results,
+        "uploaded": uploaded,
+        "failed": len(results) - uploaded
+    })
+
+@router.post("/upload/presign")
+async def presign_upload(data: PresignUploadRequest, auth: AuthContext = Depends(get_auth_context)):
+    """
+    Rilascia un presigned POST per caricare l'immagine direttamente su S3.
+    La chiave è generata dal server e la policy vincola Content-Type, dimensione
+    e metadata, quindi il browser non può caricare altro rispetto a quanto dichiarato.
+    """
     try:
-        id_token = extract_id_token(authorization)
-        if not id_token:
-            raise HTTPException(status_code=401, detail="Token di autenticazione non trovato")
+        user_id = upload_owner(auth, data.userId)
 
-        user_id = userId or extract_user_id(id_token)
-        if not user_id:
-            raise HTTPException(status_code=401, detail="UserId non trovato nel token")
+        if not data.contentType.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Sono consentite solo immagini")
+        if data.size <= 0 or data.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Dimensione non consentita (massimo {MAX_UPLOAD_BYTES} byte)")
 
-        file_content = await file.read()
-        display_name = name or file.filename
-        unique_filename = generate_s3_key(user_id, file)
-        metadata = build_metadata(file, display_name, tags, user_id)
+        display_name = data.name or data.filename
+        unique_filename = generate_s3_key(user_id, data.filename)
+        metadata = build_metadata(data.filename, display_name, data.tags, user_id)
 
-        s3_client = get_s3_client(id_token, authorization)
+        fields = {'Content-Type': data.contentType}
+        conditions = [
+            {'Content-Type': data.contentType},
+            ['content-length-range', data.size, data.size]
+        ]
+        for meta_key, meta_value in metadata.items():
+            fields[f'x-amz-meta-{meta_key}'] = meta_value
+            conditions.append({f'x-amz-meta-{meta_key}': meta_value})
 
-        s3_client.put_object(
-            Body=file_content,
+        s3_client = auth.s3
+        presigned = await run_blocking(
+            s3_client.generate_presigned_post,
             Bucket=BUCKET_NAME,
             Key=unique_filename,
-            ContentType=file.content_type,
-            Metadata=metadata
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=PRESIGNED_UPLOAD_EXPIRES
         )
-        image_url = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{unique_filename}"
-        await file.seek(0)
 
         return JSONResponse({
-            "message": "Image uploaded successfully",
-            "url": image_url,
+            "url": presigned['url'],
+            "fields": presigned['fields'],
             "filename": unique_filename,
             "name": display_name,
+            "expires_in": PRESIGNED_UPLOAD_EXPIRES
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Errore durante la generazione del presigned POST: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Presign error: {str(e)}")
+
+@router.post("/upload/complete")
+async def complete_upload(data: CompleteUploadRequest, auth: AuthContext = Depends(get_auth_context)):
+    """Registra un upload diretto su S3 dopo che il browser ha completato il presigned POST."""
+    try:
+        user_id = upload_owner(auth, data.userId)
+        if not data.filename.startswith(f"users/{user_id}/"):
+            raise HTTPException(status_code=403, detail="Chiave non appartenente all'utente")
+
+        s3_client = auth.s3
+        try:
+            head = await run_blocking(s3_client.head_object, Bucket=BUCKET_NAME, Key=data.filename)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise HTTPException(status_code=404, detail="Upload non trovato su S3")
+            raise
+
+        metadata = head.get('Metadata', {})
+        tags = metadata.get('tags')
+        dynamodb_client = auth.dynamodb
+        await run_blocking(
+            manifest.put_image, dynamodb_client, user_id, data.filename, head['ContentLength'],
+            head['LastModified'].isoformat(), metadata, head.get('ETag')
+        )
+        await tag_index.reindex(dynamodb_client, user_id, added={data.filename: tag_index.user_tags(tags)})
+        await user_version.touch(dynamodb_client, user_id)
+        image_url = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{data.filename}"
+
+        return JSONResponse({
+            "message": "Image uploaded successfully",
+            "url": image_url,
+            "filename": data.filename,
+            "name": metadata.get('displayname', data.filename.split('/')[-1]),
             "tags": tags.split(',') if tags else []
         })
 
+    except HTTPException:
+        raise
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code', '')
         error_msg = e.response.get('Error', {}).get('Message', '')
         print(f"AWS S3 error: {error_code} - {error_msg}")
         raise HTTPException(status_code=500, detail=f"AWS S3 error: {error_code} - {error_msg}")
     except Exception as e:
-        print(f"Errore durante l'upload: {str(e)}")
+        print(f"Errore durante la registrazione dell'upload: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
 
-@router.delete("/delete/{filename}")
+# filename è la chiave S3 completa (users/{user_id}/...): ":path" accetta le "/"
+@router.delete("/delete/{filename:path}")
 async def delete_image(
     filename: str, 
-    current_user = Depends(get_current_user),
-    authorization: Optional[str] = Header(None)
+    auth: AuthContext = Depends(get_auth_context)
 ):
     try:
-        token = None
-        if authorization and authorization.startswith('Bearer '):
-            token = authorization.replace('Bearer ', '')
-        s3_client = get_s3_client(token, authorization)
-        s3_client.delete_object(Bucket=BUCKET_NAME, Key=filename)
+        user_id = upload_owner(auth, None)
+        if not filename.startswith(f"users/{user_id}/"):
+            raise HTTPException(status_code=403, detail="Chiave non appartenente all'utente")
+
+        s3_client = auth.s3
+        await run_blocking(s3_client.delete_object, Bucket=BUCKET_NAME, Key=filename)
+        await delete_keys(s3_client, BUCKET_NAME, derivative_keys([filename]))
+        dynamodb_client = auth.dynamodb
+        await delete_label_items(dynamodb_client, [filename])
+        removed = await tag_index.indexed_tags(dynamodb_client, user_id, [filename])
+        await run_blocking(manifest.delete_entries, dynamodb_client, user_id, [filename])
+        await tag_index.reindex(dynamodb_client, user_id, removed=removed)
+        await user_version.touch(dynamodb_client, user_id)
         return JSONResponse({"message": "Image deleted successfully"})
+    except HTTPException:
+        raise
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"AWS S3 error: {str(e)}")
         s3_client.delete_object(Bucket=BUCKET_NAME, Key=filename)
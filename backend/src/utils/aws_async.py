@@ -0,0 +1,29 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool dedicato alle chiamate bloccanti (boto3, Cognito, HTTP): l'event loop resta libero
+AWS_EXECUTOR_WORKERS = int(os.getenv('AWS_EXECUTOR_WORKERS', '64'))
+
+_executor = ThreadPoolExecutor(max_workers=AWS_EXECUTOR_WORKERS, thread_name_prefix='aws')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Esegue una funzione bloccante nel pool AWS e ne attende il risultato."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def gather_bounded(limit: int, *aws, return_exceptions: bool = False):
+    """
+    Come asyncio.gather, ma con al massimo `limit` awaitable in esecuzione
+    contemporaneamente. L'ordine dei risultati segue quello degli argomenti.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(bounded(aw) for aw in aws), return_exceptions=return_exceptions)
@@ -0,0 +1,83 @@
+import datetime
+import os
+import threading
+import time
+import boto3
+from botocore.config import Config
+from utils.cache import ExpiringLRUCache
+from utils.metrics import instrument_session
+
+AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_CLIENT_CACHE_SIZE = int(os.getenv('AWS_CLIENT_CACHE_SIZE', '256'))
+
+# Sessione unica: modelli dei servizi ed endpoint vengono caricati una sola volta
+session = boto3.session.Session(region_name=AWS_REGION)
+# Hook di metriche (chiamate, latenze, retry, throttling) ereditati da tutti i client
+instrument_session(session)
+_session_lock = threading.Lock()
+
+_SERVICE_CONFIGS = {
+    's3': Config(
+        signature_version='s3v4',
+        retries={'max_attempts': 3},
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS
+    ),
+    'dynamodb': Config(
+        retries={'max_attempts': 3},
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS
+    ),
+}
+_DEFAULT_CONFIG = Config(max_pool_connections=AWS_MAX_POOL_CONNECTIONS)
+
+
+def _close_client(client):
+    client.close()
+
+
+# Client per set di credenziali temporanee: (servizio, AccessKeyId) -> client
+_clients = ExpiringLRUCache(max_entries=AWS_CLIENT_CACHE_SIZE, on_evict=_close_client, name='aws_clients')
+
+
+def _expiration_timestamp(credentials: dict) -> float:
+    expiration = credentials.get('Expiration')
+    if isinstance(expiration, str):
+        expiration = datetime.datetime.fromisoformat(expiration)
+    if isinstance(expiration, datetime.datetime):
+        return expiration.timestamp()
+    # Senza scadenza nota il client resta in cache per al massimo un'ora
+    return time.time() + 3600
+
+
+def create_client(service: str, **kwargs):
+    """Crea un client dalla sessione condivisa (la creazione non è thread-safe)."""
+    kwargs.setdefault('region_name', AWS_REGION)
+    kwargs.setdefault('config', _SERVICE_CONFIGS.get(service, _DEFAULT_CONFIG))
+    with _session_lock:
+        return session.client(service, **kwargs)
+
+
+def get_client(service: str, credentials: dict):
+    """
+    Restituisce un client riutilizzabile per le credenziali temporanee Cognito date.
+    Il client (e il suo pool di connessioni) viene chiuso quando le credenziali scadono
+    o quando viene rimosso dalla cache LRU.
+    """
+    def load():
+        client = create_client(
+            service,
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+        return client, _expiration_timestamp(credentials)
+
+    return _clients.get_or_load((service, credentials['AccessKeyId']), load)
+
+
+def s3_client_for(credentials: dict):
+    return get_client('s3', credentials)
+
+
+def dynamodb_client_for(credentials: dict):
+    return get_client('dynamodb', credentials)
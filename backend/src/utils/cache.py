@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+from utils.metrics import record_cache
+
+
+class ExpiringLRUCache:
+    """
+    Cache LRU thread-safe con scadenza per singola entry.
+    - Le entry scadute vengono scartate alla lettura.
+    - Oltre `max_entries` viene rimossa l'entry usata meno di recente.
+    - `get_or_load` garantisce un solo caricamento concorrente per chiave
+      (single-flight): le richieste parallele attendono il primo loader.
+    - Con `name` gli hit e i miss di `get_or_load` finiscono nelle metriche.
+    """
+
+    def __init__(self, max_entries: int = 1024, on_evict: Optional[Callable[[Any], None]] = None,
+                 name: Optional[str] = None):
+        self.max_entries = max_entries
+        self.name = name
+        self._on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        evicted = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                evicted = value
+            else:
+                self._entries.move_to_end(key)
+                return value
+        self._evict(evicted)
+        return None
+
+    def put(self, key: Hashable, value: Any, expires_at: float):
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                evicted.append(self._entries.pop(key)[1])
+            self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1][1])
+        for value in evicted:
+            self._evict(value)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._evict(entry[1])
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Tuple[Any, float]]) -> Any:
+        """
+        Restituisce il valore in cache o lo carica con `loader`, che deve
+        restituire la coppia (valore, scadenza come timestamp epoch).
+        """
+        value = self.get(key)
+        if value is not None:
+            self._record(True)
+            return value
+
+        with self._lock:
+            flight = self._inflight.setdefault(key, threading.Lock())
+        with flight:
+            # Un'altra richiesta potrebbe aver già caricato il valore
+            value = self.get(key)
+            if value is not None:
+                self._record(True)
+                return value
+            self._record(False)
+            try:
+                value, expires_at = loader()
+                self.put(key, value, expires_at)
+                return value
+            finally:
+                with self._lock:
+                    if self._inflight.get(key) is flight:
+                        del self._inflight[key]
+
+    def clear(self):
+        with self._lock:
+            values = [value for _, value in self._entries.values()]
+            self._entries.clear()
+        for value in values:
+            self._evict(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _record(self, hit: bool):
+        if self.name:
+            record_cache(self.name, hit)
+
+    def _evict(self, value: Any):
+        if value is not None and self._on_evict is not None:
+            try:
+                self._on_evict(value)
+            except Exception as e:
+                print(f"Errore durante l'eviction dalla cache: {str(e)}")
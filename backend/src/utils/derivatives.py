@@ -0,0 +1,18 @@
+import os
+
+# Stesse convenzioni di terraform/lambda/derivatives.py, che genera i file
+DERIVATIVE_PREFIX = os.getenv('DERIVATIVE_PREFIX', 'derivatives')
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '256'))
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', '1024'))
+DERIVATIVE_SIZES = (THUMBNAIL_SIZE, PREVIEW_SIZE)
+
+
+def derivative_key(key: str, size: int) -> str:
+    """users/u/album/foto.jpg -> derivatives/256/users/u/album/foto.webp"""
+    base = key.rsplit('.', 1)[0] if '.' in key.rsplit('/', 1)[-1] else key
+    return f"{DERIVATIVE_PREFIX}/{size}/{base}.webp"
+
+
+def derivative_keys(keys: list) -> list:
+    """Tutte le derivate delle chiavi indicate, da eliminare insieme agli originali."""
+    return [derivative_key(key, size) for key in keys for size in DERIVATIVE_SIZES]
@@ -0,0 +1,33 @@
+import time
+from utils.s3_batch import chunked
+
+# Limite DynamoDB per singola BatchWriteItem
+DYNAMODB_WRITE_BATCH_SIZE = 25
+BATCH_MAX_RETRIES = 5
+
+
+def batch_write(dynamodb_client, table: str, requests: list) -> list:
+    """
+    Esegue le WriteRequest (PutRequest/DeleteRequest) a blocchi da 25, ritentando
+    le UnprocessedItems con backoff esponenziale. Restituisce le richieste rimaste
+    non elaborate dopo BATCH_MAX_RETRIES tentativi.
+    """
+    failed = []
+    for chunk in chunked(requests, DYNAMODB_WRITE_BATCH_SIZE):
+        pending = {table: chunk}
+        attempt = 0
+        while pending:
+            response = dynamodb_client.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems')
+            if pending:
+                attempt += 1
+                if attempt > BATCH_MAX_RETRIES:
+                    failed.extend(pending.get(table, []))
+                    break
+                time.sleep(min(0.05 * (2 ** attempt), 1.0))
+    return failed
+
+
+def delete_requests(keys: list) -> list:
+    """Converte una lista di chiavi DynamoDB in DeleteRequest per batch_write."""
+    return [{'DeleteRequest': {'Key': key}} for key in keys]
@@ -0,0 +1,20 @@
+import json
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: senza, si usa il modulo json standard
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serializzata con orjson quando disponibile (molto più veloce su liste grandi)."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
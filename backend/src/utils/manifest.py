@@ -0,0 +1,148 @@
+import base64
+import binascii
+import os
+import time
+from typing import Optional
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from utils.dynamodb_batch import batch_write, delete_requests, BATCH_MAX_RETRIES
+from utils.s3_batch import chunked
+
+# Indice per utente delle immagini: UserId (partition) + ImageKey (sort).
+# Gli album sono item marker con ImageKey che termina con '/', come le cartelle S3.
+MANIFEST_TABLE = os.getenv('MANIFEST_TABLE', 'ImageManifest')
+# Limite DynamoDB per singola BatchGetItem
+MANIFEST_BATCH_GET_SIZE = 100
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def from_item(item: dict) -> dict:
+    """Converte un item DynamoDB (formato client) in un dict Python."""
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+def album_of(user_id: str, key: str) -> Optional[str]:
+    parts = key[len(f"users/{user_id}/"):].split('/')
+    return parts[0] if len(parts) > 1 and parts[0] else None
+
+
+def put_image(dynamodb_client, user_id: str, key: str, size: int, last_modified: str,
+              metadata: Optional[dict] = None, etag: Optional[str] = None, label_names: Optional[list] = None,
+              labels: Optional[list] = None):
+    """
+    Registra o aggiorna l'immagine nel manifest. Usa UpdateItem (SET dei soli campi
+    indicati) così l'ordine rispetto alla Lambda, che scrive LabelNames e Labels
+    (con la confidenza), è indifferente.
+    """
+    metadata = metadata or {}
+    values = {
+        'Size': size,
+        'LastModified': last_modified,
+        'Metadata': metadata,
+        'Name': metadata.get('displayname') or key.split('/')[-1]
+    }
+    album = album_of(user_id, key)
+    if album:
+        values['Album'] = album
+    if etag:
+        values['ETag'] = etag.strip('"')
+    if label_names is not None:
+        values['LabelNames'] = label_names
+    if labels is not None:
+        values['Labels'] = labels
+
+    names = {f"#f{i}": name for i, name in enumerate(values)}
+    dynamodb_client.update_item(
+        TableName=MANIFEST_TABLE,
+        Key={'UserId': {'S': user_id}, 'ImageKey': {'S': key}},
+        UpdateExpression='SET ' + ', '.join(f"#f{i} = :v{i}" for i in range(len(values))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues={
+            f":v{i}": _serializer.serialize(value) for i, value in enumerate(values.values())
+        }
+    )
+
+
+def put_album(dynamodb_client, user_id: str, album_name: str):
+    dynamodb_client.put_item(
+        TableName=MANIFEST_TABLE,
+        Item={
+            'UserId': {'S': user_id},
+            'ImageKey': {'S': f"users/{user_id}/{album_name}/"},
+            'Album': {'S': album_name}
+        }
+    )
+
+
+def get_entry(dynamodb_client, user_id: str, key: str) -> Optional[dict]:
+    response = dynamodb_client.get_item(
+        TableName=MANIFEST_TABLE,
+        Key={'UserId': {'S': user_id}, 'ImageKey': {'S': key}},
+        ConsistentRead=True
+    )
+    return from_item(response['Item']) if 'Item' in response else None
+
+
+def get_entries(dynamodb_client, user_id: str, keys: list) -> dict:
+    """Legge le voci indicate con BatchGetItem (blocchi da 100). Restituisce {ImageKey: voce}."""
+    entries = {}
+    for chunk in chunked(list(dict.fromkeys(keys)), MANIFEST_BATCH_GET_SIZE):
+        request = {MANIFEST_TABLE: {'Keys': [{'UserId': {'S': user_id}, 'ImageKey': {'S': key}} for key in chunk]}}
+        attempt = 0
+        while request:
+            response = dynamodb_client.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(MANIFEST_TABLE, []):
+                entry = from_item(item)
+                entries[entry['ImageKey']] = entry
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                if attempt > BATCH_MAX_RETRIES:
+                    print(f"UnprocessedKeys {MANIFEST_TABLE} non recuperate dopo {BATCH_MAX_RETRIES} tentativi")
+                    break
+                time.sleep(min(0.05 * (2 ** attempt), 1.0))
+    return entries
+
+
+def delete_entries(dynamodb_client, user_id: str, keys: list) -> list:
+    """Rimuove le chiavi dal manifest con BatchWriteItem. Restituisce le chiavi non rimosse."""
+    failed = batch_write(
+        dynamodb_client,
+        MANIFEST_TABLE,
+        delete_requests([{'UserId': {'S': user_id}, 'ImageKey': {'S': key}} for key in keys])
+    )
+    return [request['DeleteRequest']['Key']['ImageKey']['S'] for request in failed]
+
+
+def encode_cursor(last_key: Optional[dict]) -> Optional[str]:
+    if not last_key:
+        return None
+    return base64.urlsafe_b64encode(last_key['ImageKey']['S'].encode()).decode()
+
+
+def decode_cursor(user_id: str, cursor: str) -> dict:
+    """Il cursore contiene solo ImageKey: l'utente viene sempre dal path, non dal client."""
+    try:
+        key = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Cursore non valido")
+    if not key.startswith(f"users/{user_id}/"):
+        raise ValueError("Cursore non valido")
+    return {'UserId': {'S': user_id}, 'ImageKey': {'S': key}}
+
+
+def query_page(dynamodb_client, user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """Una pagina del manifest dell'utente, in ordine di ImageKey. Restituisce (items, next_cursor)."""
+    params = {
+        'TableName': MANIFEST_TABLE,
+        # Solo immagini e album: esclude gli item di servizio (es. '#version')
+        'KeyConditionExpression': 'UserId = :user_id AND begins_with(ImageKey, :prefix)',
+        'ExpressionAttributeValues': {':user_id': {'S': user_id}, ':prefix': {'S': f"users/{user_id}/"}}
+    }
+    if limit:
+        params['Limit'] = limit
+    if cursor:
+        params['ExclusiveStartKey'] = decode_cursor(user_id, cursor)
+    response = dynamodb_client.query(**params)
+    return [from_item(item) for item in response.get('Items', [])], encode_cursor(response.get('LastEvaluatedKey'))
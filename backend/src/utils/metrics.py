@@ -0,0 +1,268 @@
+import bisect
+import os
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+
+# Metriche in memoria del processo, esposte in formato testo Prometheus su /metrics.
+# Ogni osservazione costa un lock e un'operazione su dict: abbastanza poco da
+# lasciarle sempre attive (METRICS_ENABLED=false le disattiva comunque).
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Codici di errore AWS che indicano throttling (S3, DynamoDB, Cognito, STS)
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'SlowDown', 'RequestThrottled'
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        # Conteggi per bucket non cumulativi: la somma cumulativa si fa solo in render
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        lines = self._header()
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Richieste HTTP completate.', ('method', 'handler', 'status')))
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Durata delle richieste HTTP.', ('method', 'handler')))
+http_requests_in_flight = registry.register(Gauge(
+    'http_requests_in_flight', 'Richieste HTTP in corso.', ('method',)))
+
+aws_calls = registry.register(Counter(
+    'aws_api_calls_total', 'Chiamate alle API AWS (esclusi i retry interni di botocore).', ('service', 'operation')))
+aws_call_duration = registry.register(Histogram(
+    'aws_api_call_duration_seconds', 'Durata delle chiamate AWS, retry inclusi.', ('service', 'operation')))
+aws_errors = registry.register(Counter(
+    'aws_api_errors_total', 'Chiamate AWS terminate con errore.', ('service', 'operation', 'code')))
+aws_retries = registry.register(Counter(
+    'aws_api_retries_total', 'Tentativi ripetuti da botocore.', ('service', 'operation')))
+aws_throttles = registry.register(Counter(
+    'aws_api_throttles_total', 'Risposte AWS di throttling, anche se poi ritentate con successo.', ('service', 'operation')))
+
+cache_requests = registry.register(Counter(
+    'cache_requests_total', 'Letture delle cache in memoria per esito (hit o miss).', ('cache', 'result')))
+
+auth_duration = registry.register(Histogram(
+    'auth_duration_seconds', "Costo dell'autenticazione per richiesta (token, credenziali Cognito, client AWS).",
+    ('result',)))
+
+
+def record_cache(cache: str, hit: bool):
+    if METRICS_ENABLED:
+        cache_requests.inc(cache, 'hit' if hit else 'miss')
+
+
+def record_auth(seconds: float, ok: bool):
+    if METRICS_ENABLED:
+        auth_duration.observe(seconds, 'ok' if ok else 'error')
+
+
+def render() -> str:
+    return registry.render()
+
+
+# --- Hook botocore -----------------------------------------------------------
+
+_START_KEY = 'metrics_start'
+
+
+def _operation_of(event_name: str) -> Tuple[str, str]:
+    # Gli eventi hanno la forma "<evento>.<servizio>.<operazione>"
+    parts = event_name.split('.')
+    return (parts[1], parts[2]) if len(parts) >= 3 else ('unknown', 'unknown')
+
+
+def _before_call(event_name: str, context: Optional[dict] = None, **kwargs):
+    if context is not None:
+        context[_START_KEY] = time.perf_counter()
+
+
+def _observe_call(event_name: str, context: Optional[dict]) -> Tuple[str, str]:
+    service, operation = _operation_of(event_name)
+    aws_calls.inc(service, operation)
+    start = (context or {}).get(_START_KEY)
+    if start is not None:
+        aws_call_duration.observe(time.perf_counter() - start, service, operation)
+    return service, operation
+
+
+def _after_call(event_name: str, parsed: Optional[dict] = None, context: Optional[dict] = None, **kwargs):
+    service, operation = _observe_call(event_name, context)
+    parsed = parsed or {}
+    attempts = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if attempts:
+        aws_retries.inc(service, operation, amount=attempts)
+    code = parsed.get('Error', {}).get('Code')
+    if code:
+        aws_errors.inc(service, operation, code)
+
+
+def _after_call_error(event_name: str, exception: Optional[Exception] = None, context: Optional[dict] = None, **kwargs):
+    # Errori senza risposta HTTP (connessione, timeout): i ClientError passano da after-call
+    service, operation = _observe_call(event_name, context)
+    aws_errors.inc(service, operation, type(exception).__name__ if exception else 'unknown')
+
+
+def _needs_retry(event_name: str, response=None, **kwargs):
+    # Emesso dopo ogni tentativo: conta anche i throttling poi risolti dai retry.
+    # Restituisce sempre None per non interferire con la decisione di retry.
+    if response is not None:
+        code = (response[1] or {}).get('Error', {}).get('Code')
+        if code in THROTTLE_CODES:
+            aws_throttles.inc(*_operation_of(event_name))
+    return None
+
+
+def instrument_session(session):
+    """Registra gli hook sulla sessione: valgono per i client creati dopo la chiamata."""
+    if not METRICS_ENABLED:
+        return
+    events = session.events
+    events.register('before-call', _before_call, unique_id='metrics-before-call')
+    events.register('after-call', _after_call, unique_id='metrics-after-call')
+    events.register('after-call-error', _after_call_error, unique_id='metrics-after-call-error')
+    events.register('needs-retry', _needs_retry, unique_id='metrics-needs-retry')
+
+
+# --- Middleware ASGI ---------------------------------------------------------
+
+UNMATCHED_HANDLER = '<unmatched>'
+
+
+class MetricsMiddleware:
+    """
+    Latenza ed esito per route, richieste in corso per metodo. La route è
+    identificata dall'handler (es. get_user_images) che il router lascia nello
+    scope dopo il routing, non dal path: la cardinalità resta pari al numero di route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        # La route è nota solo dopo il routing: le richieste in corso sono per metodo
+        http_requests_in_flight.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            handler = getattr(scope.get('endpoint'), '__name__', None) or UNMATCHED_HANDLER
+            http_request_duration.observe(time.perf_counter() - start, method, handler)
+            http_requests.inc(method, handler, str(status))
+            http_requests_in_flight.dec(method)
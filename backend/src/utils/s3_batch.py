@@ -0,0 +1,46 @@
+import os
+from utils.aws_async import run_blocking, gather_bounded
+
+# Limite S3 per singola DeleteObjects
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_CONCURRENCY = int(os.getenv('S3_DELETE_CONCURRENCY', '4'))
+
+
+def chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _delete_batch(s3_client, bucket: str, keys: list):
+    response = s3_client.delete_objects(
+        Bucket=bucket,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+    )
+    # In modalità Quiet la risposta contiene solo gli errori
+    errors = {
+        error['Key']: f"{error.get('Code', '')}: {error.get('Message', '')}"
+        for error in response.get('Errors', [])
+    }
+    return [key for key in keys if key not in errors], errors
+
+
+async def delete_keys(s3_client, bucket: str, keys: list):
+    """
+    Elimina le chiavi con DeleteObjects a blocchi da 1000, inviati in parallelo
+    (massimo S3_DELETE_CONCURRENCY). Restituisce (chiavi eliminate, {chiave: errore}).
+    """
+    batches = list(chunked(keys, S3_DELETE_BATCH_SIZE))
+    results = await gather_bounded(
+        S3_DELETE_CONCURRENCY,
+        *(run_blocking(_delete_batch, s3_client, bucket, batch) for batch in batches),
+        return_exceptions=True
+    )
+    deleted = []
+    errors = {}
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            errors.update({key: str(result) for key in batch})
+        else:
+            deleted.extend(result[0])
+            errors.update(result[1])
+    return deleted, errors
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from fastapi import UploadFile
+from utils.aws_async import run_blocking
+
+# S3 richiede parti di almeno 5 MiB (tranne l'ultima)
+UPLOAD_PART_SIZE = max(int(os.getenv('UPLOAD_PART_SIZE_MB', '8')), 5) * 1024 * 1024
+UPLOAD_PART_CONCURRENCY = int(os.getenv('UPLOAD_PART_CONCURRENCY', '4'))
+
+
+async def stream_upload(s3_client, file: UploadFile, bucket: str, key: str, content_type: str, metadata: dict) -> int:
+    """
+    Carica su S3 il contenuto di un UploadFile leggendolo a blocchi dallo spool.
+    - File più piccoli di una parte: una sola put_object.
+    - Altrimenti multipart upload con al massimo UPLOAD_PART_CONCURRENCY parti in volo,
+      quindi la memoria occupata resta di poche parti indipendentemente dalla dimensione.
+    - In caso di errore l'upload multipart viene annullato (abort) per non lasciare parti orfane.
+    Restituisce il numero di byte caricati.
+    """
+    chunk = await file.read(UPLOAD_PART_SIZE)
+    next_chunk = await file.read(UPLOAD_PART_SIZE) if len(chunk) == UPLOAD_PART_SIZE else b''
+    if not next_chunk:
+        await run_blocking(
+            s3_client.put_object,
+            Body=chunk,
+            Bucket=bucket,
+            Key=key,
+            ContentType=content_type,
+            Metadata=metadata
+        )
+        return len(chunk)
+
+    upload = await run_blocking(
+        s3_client.create_multipart_upload,
+        Bucket=bucket,
+        Key=key,
+        ContentType=content_type,
+        Metadata=metadata
+    )
+    upload_id = upload['UploadId']
+    semaphore = asyncio.Semaphore(UPLOAD_PART_CONCURRENCY)
+    tasks = []
+
+    async def send_part(part_number: int, body: bytes) -> dict:
+        try:
+            response = await run_blocking(
+                s3_client.upload_part,
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            semaphore.release()
+
+    size = 0
+    try:
+        part_number = 1
+        while chunk:
+            await semaphore.acquire()
+            # Interrompi subito la lettura se una parte è già fallita
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+            tasks.append(asyncio.ensure_future(send_part(part_number, chunk)))
+            size += len(chunk)
+            part_number += 1
+            chunk, next_chunk = next_chunk, (await file.read(UPLOAD_PART_SIZE) if next_chunk else b'')
+
+        parts = await asyncio.gather(*tasks)
+        await run_blocking(
+            s3_client.complete_multipart_upload,
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        return size
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await run_blocking(s3_client.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            print(f"Errore durante l'abort del multipart upload {upload_id}: {str(e)}")
+        raise
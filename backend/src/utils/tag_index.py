@@ -0,0 +1,203 @@
+import heapq
+import os
+from decimal import Decimal
+from typing import Optional
+from botocore.exceptions import ClientError
+from utils.aws_async import run_blocking
+from utils import manifest
+
+# Indice invertito per utente: tag -> immagini, più il vocabolario dei tag con i conteggi.
+#   Posting:     Partition "T#{user_id}#{tag}", Sort ImageKey, Confidence
+#   Vocabolario: Partition "V#{user_id}",       Sort tag,      Label, Count
+# I tag sono normalizzati (minuscolo, spazi compattati); Label conserva la forma originale.
+TAG_INDEX_TABLE = os.getenv('TAG_INDEX_TABLE', 'ImageTagIndex')
+# I tag inseriti dall'utente valgono come label a confidenza piena
+USER_TAG_CONFIDENCE = Decimal('100')
+
+
+def normalize_tag(tag: str) -> str:
+    return ' '.join(str(tag).split()).lower()
+
+
+def posting_partition(user_id: str, tag: str) -> str:
+    return f"T#{user_id}#{normalize_tag(tag)}"
+
+
+def vocabulary_partition(user_id: str) -> str:
+    return f"V#{user_id}"
+
+
+def user_tags(tags: Optional[str]) -> dict:
+    """Tag utente (stringa separata da virgole, come in build_metadata) -> {tag: confidenza}."""
+    return {tag.strip(): USER_TAG_CONFIDENCE for tag in (tags or '').split(',') if tag.strip()}
+
+
+def entry_tags(entry: Optional[dict]) -> dict:
+    """Tutti i tag indicizzati di una voce del manifest: label Rekognition e tag utente."""
+    if not entry:
+        return {}
+    tags = {}
+    for label in entry.get('Labels') or []:
+        tags[label['Name']] = Decimal(str(label.get('Confidence', 0)))
+    for name in entry.get('LabelNames') or []:
+        tags.setdefault(name, Decimal('0'))
+    for tag, confidence in user_tags(entry.get('Metadata', {}).get('tags')).items():
+        tags[tag] = max(tags.get(tag, Decimal('0')), confidence)
+    return tags
+
+
+def _is_conditional_failure(error: ClientError) -> bool:
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def add_postings(dynamodb_client, user_id: str, image_key: str, tags: dict):
+    """
+    Aggiunge l'immagine ai posting dei tag. Il posting è scritto solo se non esiste,
+    così i conteggi del vocabolario restano corretti anche con scritture ripetute
+    (retry, Lambda e route che indicizzano la stessa immagine).
+    """
+    for tag, confidence in tags.items():
+        normalized = normalize_tag(tag)
+        if not normalized:
+            continue
+        try:
+            dynamodb_client.put_item(
+                TableName=TAG_INDEX_TABLE,
+                Item={
+                    'Partition': {'S': posting_partition(user_id, normalized)},
+                    'Sort': {'S': image_key},
+                    'Confidence': {'N': str(confidence)}
+                },
+                ConditionExpression='attribute_not_exists(#sort)',
+                ExpressionAttributeNames={'#sort': 'Sort'}
+            )
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                continue
+            raise
+        dynamodb_client.update_item(
+            TableName=TAG_INDEX_TABLE,
+            Key={'Partition': {'S': vocabulary_partition(user_id)}, 'Sort': {'S': normalized}},
+            UpdateExpression='ADD #count :one SET #label = if_not_exists(#label, :label)',
+            ExpressionAttributeNames={'#count': 'Count', '#label': 'Label'},
+            ExpressionAttributeValues={':one': {'N': '1'}, ':label': {'S': str(tag).strip()}}
+        )
+
+
+def remove_postings(dynamodb_client, user_id: str, image_key: str, tags):
+    """Rimuove l'immagine dai posting dei tag e aggiorna i conteggi del vocabolario."""
+    for tag in tags:
+        normalized = normalize_tag(tag)
+        if not normalized:
+            continue
+        response = dynamodb_client.delete_item(
+            TableName=TAG_INDEX_TABLE,
+            Key={'Partition': {'S': posting_partition(user_id, normalized)}, 'Sort': {'S': image_key}},
+            ReturnValues='ALL_OLD'
+        )
+        if 'Attributes' not in response:
+            continue
+        vocabulary_key = {'Partition': {'S': vocabulary_partition(user_id)}, 'Sort': {'S': normalized}}
+        updated = dynamodb_client.update_item(
+            TableName=TAG_INDEX_TABLE,
+            Key=vocabulary_key,
+            UpdateExpression='ADD #count :minus_one',
+            ExpressionAttributeNames={'#count': 'Count'},
+            ExpressionAttributeValues={':minus_one': {'N': '-1'}},
+            ReturnValues='UPDATED_NEW'
+        )
+        if int(updated['Attributes']['Count']['N']) <= 0:
+            # Il tag non ha più immagini: esce dall'autocompletamento
+            try:
+                dynamodb_client.delete_item(
+                    TableName=TAG_INDEX_TABLE,
+                    Key=vocabulary_key,
+                    ConditionExpression='#count <= :zero',
+                    ExpressionAttributeNames={'#count': 'Count'},
+                    ExpressionAttributeValues={':zero': {'N': '0'}}
+                )
+            except ClientError as e:
+                if not _is_conditional_failure(e):
+                    raise
+
+
+def query_postings(dynamodb_client, user_id: str, tag: str) -> dict:
+    """Tutte le immagini con il tag: {ImageKey: confidenza}."""
+    postings = {}
+    params = {
+        'TableName': TAG_INDEX_TABLE,
+        'KeyConditionExpression': '#partition = :partition',
+        'ExpressionAttributeNames': {'#partition': 'Partition', '#sort': 'Sort', '#confidence': 'Confidence'},
+        'ExpressionAttributeValues': {':partition': {'S': posting_partition(user_id, tag)}},
+        'ProjectionExpression': '#sort, #confidence'
+    }
+    while True:
+        response = dynamodb_client.query(**params)
+        for item in response.get('Items', []):
+            postings[item['Sort']['S']] = float(item['Confidence']['N'])
+        if 'LastEvaluatedKey' not in response:
+            return postings
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def suggest(dynamodb_client, user_id: str, prefix: str, limit: int) -> list:
+    """
+    Tag del vocabolario che iniziano con il prefisso, ordinati per numero di immagini.
+    Il vocabolario è in ordine alfabetico, quindi vengono lette tutte le pagine che
+    corrispondono al prefisso (al massimo l'intero vocabolario dell'utente) prima di
+    ordinare per Count: una sola pagina darebbe i più usati tra i primi in ordine alfabetico.
+    """
+    params = {
+        'TableName': TAG_INDEX_TABLE,
+        'KeyConditionExpression': '#partition = :partition',
+        'ExpressionAttributeNames': {'#partition': 'Partition', '#sort': 'Sort', '#label': 'Label', '#count': 'Count'},
+        'ExpressionAttributeValues': {':partition': {'S': vocabulary_partition(user_id)}},
+        'ProjectionExpression': '#sort, #label, #count'
+    }
+    prefix = normalize_tag(prefix)
+    # Prefisso vuoto: i tag più usati dell'intero vocabolario (begins_with non accetta '')
+    if prefix:
+        params['KeyConditionExpression'] += ' AND begins_with(#sort, :prefix)'
+        params['ExpressionAttributeValues'][':prefix'] = {'S': prefix}
+    suggestions = []
+    while True:
+        response = dynamodb_client.query(**params)
+        suggestions.extend(
+            {"tag": item.get('Label', item['Sort'])['S'], "count": int(item['Count']['N'])}
+            for item in response.get('Items', [])
+            if int(item.get('Count', {}).get('N', '0')) > 0
+        )
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    # Solo i primi `limit`: evita di ordinare l'intero vocabolario
+    return heapq.nsmallest(limit, suggestions, key=lambda suggestion: (-suggestion['count'], suggestion['tag'].lower()))
+
+
+def _apply(dynamodb_client, user_id: str, added: dict, removed: dict):
+    for image_key, tags in removed.items():
+        remove_postings(dynamodb_client, user_id, image_key, tags)
+    for image_key, tags in added.items():
+        add_postings(dynamodb_client, user_id, image_key, tags)
+
+
+async def reindex(dynamodb_client, user_id: str, added: Optional[dict] = None, removed: Optional[dict] = None):
+    """
+    Aggiorna l'indice dopo una modifica: added {ImageKey: {tag: confidenza}},
+    removed {ImageKey: [tag]}. Best effort come user_version.touch: i posting
+    rimasti orfani vengono scartati dalla ricerca.
+    """
+    try:
+        await run_blocking(_apply, dynamodb_client, user_id, added or {}, removed or {})
+    except Exception as e:
+        print(f"Aggiornamento {TAG_INDEX_TABLE} non riuscito per {user_id}: {str(e)}")
+
+
+async def indexed_tags(dynamodb_client, user_id: str, keys: list) -> dict:
+    """Tag indicizzati delle chiavi, letti dal manifest prima di eliminarle: {ImageKey: [tag]}."""
+    try:
+        entries = await run_blocking(manifest.get_entries, dynamodb_client, user_id, keys)
+    except Exception as e:
+        print(f"Lettura {manifest.MANIFEST_TABLE} non riuscita per {user_id}: {str(e)}")
+        return {}
+    return {key: list(entry_tags(entry)) for key, entry in entries.items()}
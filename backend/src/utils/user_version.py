@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+from utils.cache import ExpiringLRUCache
+from utils.aws_async import run_blocking
+from utils.manifest import MANIFEST_TABLE
+
+# Contatore di modifiche per utente, salvato nel manifest come item dedicato.
+# ImageKey '#version' resta fuori dal prefisso users/ interrogato dai listing.
+VERSION_KEY = '#version'
+USER_VERSION_CACHE_SIZE = int(os.getenv('USER_VERSION_CACHE_SIZE', '10000'))
+# Le modifiche fatte da altre istanze (o dalla Lambda) diventano visibili entro questo intervallo
+USER_VERSION_CACHE_TTL = float(os.getenv('USER_VERSION_CACHE_TTL', '5'))
+
+_versions = ExpiringLRUCache(max_entries=USER_VERSION_CACHE_SIZE)
+
+
+def _version_key(user_id: str) -> dict:
+    return {'UserId': {'S': user_id}, 'ImageKey': {'S': VERSION_KEY}}
+
+
+def get_version(dynamodb_client, user_id: str) -> int:
+    def load():
+        response = dynamodb_client.get_item(
+            TableName=MANIFEST_TABLE,
+            Key=_version_key(user_id),
+            ProjectionExpression='Version',
+            ConsistentRead=True
+        )
+        version = int(response.get('Item', {}).get('Version', {}).get('N', '0'))
+        return version, time.time() + USER_VERSION_CACHE_TTL
+    return _versions.get_or_load(user_id, load)
+
+
+def bump_version(dynamodb_client, user_id: str) -> int:
+    response = dynamodb_client.update_item(
+        TableName=MANIFEST_TABLE,
+        Key=_version_key(user_id),
+        UpdateExpression='ADD Version :one',
+        ExpressionAttributeValues={':one': {'N': '1'}},
+        ReturnValues='UPDATED_NEW'
+    )
+    version = int(response['Attributes']['Version']['N'])
+    _versions.put(user_id, version, time.time() + USER_VERSION_CACHE_TTL)
+    return version
+
+
+async def touch(dynamodb_client, user_id: str):
+    """Incrementa la versione dopo una modifica. Un errore non annulla la modifica già fatta."""
+    try:
+        await run_blocking(bump_version, dynamodb_client, user_id)
+    except Exception as e:
+        # Senza incremento la cache locale non deve comunque restare indietro
+        _versions.pop(user_id)
+        print(f"Incremento versione non riuscito per {user_id}: {str(e)}")
+
+
+def make_etag(version: int, *params) -> str:
+    """ETag forte: versione dell'utente + hash dei parametri che cambiano la risposta."""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Confronto debole come da RFC 9110: un proxy può aver reso debole l'ETag
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    candidates = [candidate[2:] if candidate.startswith('W/') else candidate for candidate in candidates]
+    return '*' in candidates or etag in candidates
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli del backend importano i package relativi a src/ (come in main.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
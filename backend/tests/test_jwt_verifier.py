@@ -0,0 +1,158 @@
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from auth.jwt_verifier import JWKSVerifier, TokenVerificationError
+
+REGION = 'us-east-1'
+USER_POOL_ID = 'us-east-1_test'
+CLIENT_ID = 'test-client'
+ISSUER = f"https://cognito-idp.{REGION}.amazonaws.com/{USER_POOL_ID}"
+
+
+def _generate_key(kid: str):
+    """Coppia RSA generata al momento: (PEM privata, JWK pubblica con kid)."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+    public_jwk['kid'] = kid
+    return private_pem, public_jwk
+
+
+@pytest.fixture(scope='module')
+def signing_key():
+    return _generate_key('key-1')
+
+
+class FakeJWKS:
+    """Key set locale al posto del download da Cognito, con conteggio dei download."""
+
+    def __init__(self, *keys):
+        self.keys = list(keys)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'keys': self.keys}
+
+
+@pytest.fixture
+def jwks(signing_key):
+    return FakeJWKS(signing_key[1])
+
+
+@pytest.fixture
+def verifier(jwks):
+    return JWKSVerifier(REGION, USER_POOL_ID, CLIENT_ID, fetch_jwks=jwks, min_refresh_interval=60)
+
+
+def make_token(private_pem: str, kid: str = 'key-1', token_use: str = 'id', audience: str = CLIENT_ID,
+               issuer: str = ISSUER, expires_in: int = 3600, **claims) -> str:
+    now = int(time.time())
+    payload = {
+        'sub': 'user-sub',
+        'cognito:username': 'mario',
+        'token_use': token_use,
+        'iss': issuer,
+        'iat': now,
+        'exp': now + expires_in,
+    }
+    payload['aud' if token_use == 'id' else 'client_id'] = audience
+    payload.update(claims)
+    return jwt.encode(payload, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+def test_valid_id_token(verifier, signing_key):
+    claims = verifier.verify(make_token(signing_key[0]), 'id')
+    assert claims['token_use'] == 'id'
+    assert claims['cognito:username'] == 'mario'
+
+
+def test_wrong_audience_rejected(verifier, signing_key):
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(signing_key[0], audience='other-client'))
+
+
+def test_expired_token_rejected(verifier, signing_key):
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(signing_key[0], expires_in=-60))
+
+
+def test_wrong_issuer_rejected(verifier, signing_key):
+    other_issuer = f"https://cognito-idp.{REGION}.amazonaws.com/us-east-1_other"
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(signing_key[0], issuer=other_issuer))
+
+
+def test_token_use_mismatch_rejected(verifier, signing_key):
+    access_token = make_token(signing_key[0], token_use='access')
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(access_token, 'id')
+    id_token = make_token(signing_key[0])
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(id_token, 'access')
+
+
+def test_access_token_checked_against_client_id(verifier, signing_key):
+    claims = verifier.verify(make_token(signing_key[0], token_use='access'), 'access')
+    assert claims['client_id'] == CLIENT_ID
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(signing_key[0], token_use='access', audience='other-client'), 'access')
+
+
+def test_signature_from_another_key_rejected(verifier):
+    # Stesso kid, chiave diversa: la firma non corrisponde al JWKS
+    forged_pem, _ = _generate_key('key-1')
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(make_token(forged_pem))
+
+
+def test_unknown_kid_refresh_is_rate_limited(verifier, jwks, signing_key):
+    verifier.verify(make_token(signing_key[0]))
+    assert jwks.calls == 1
+
+    rotated_pem, rotated_jwk = _generate_key('key-2')
+    rotated_token = make_token(rotated_pem, kid='key-2')
+    # Entro min_refresh_interval un kid sconosciuto non provoca un nuovo download
+    for _ in range(3):
+        with pytest.raises(TokenVerificationError):
+            verifier.verify(rotated_token)
+    assert jwks.calls == 1
+
+    # Trascorso l'intervallo il JWKS viene ricaricato una volta e la nuova chiave è accettata
+    jwks.keys.append(rotated_jwk)
+    verifier._fetched_at -= 61
+    assert verifier.verify(rotated_token)['token_use'] == 'id'
+    assert jwks.calls == 2
+
+
+def test_verified_token_is_memoized(verifier, jwks, signing_key, monkeypatch):
+    token = make_token(signing_key[0])
+    decodes = []
+    original_decode = verifier._decode
+
+    def counting_decode(value):
+        decodes.append(value)
+        return original_decode(value)
+
+    monkeypatch.setattr(verifier, '_decode', counting_decode)
+    first = verifier.verify(token)
+    second = verifier.verify(token)
+    assert first == second
+    assert len(decodes) == 1
+    assert jwks.calls == 1
+
+
+def test_memoized_token_still_checks_token_use(verifier, signing_key):
+    token = make_token(signing_key[0])
+    verifier.verify(token, 'id')
+    with pytest.raises(TokenVerificationError):
+        verifier.verify(token, 'access')
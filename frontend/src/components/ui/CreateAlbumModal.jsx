@@ -85,7 +85,7 @@ export default function CreateAlbumModal({
                   }}
                 >
                   <img
-                    src={img.url || "/placeholder.svg"}
+                    src={img.thumbnail_url || img.url || "/placeholder.svg"}
                     alt={img.title}
                     className="w-full h-16 object-cover rounded"
                   />
@@ -16,7 +16,7 @@ export default function ImageGrid({ images, onImageClick, onDownload, onDelete,
           <CardContent className="p-0">
             <div className="relative overflow-hidden">
               <img
-                src={image.url || "/placeholder.svg"}
+                src={image.thumbnail_url || image.url || "/placeholder.svg"}
                 alt={image.title}
                 className="w-full h-48 object-cover transition-transform duration-500 group-hover:scale-110"
                 loading="lazy"
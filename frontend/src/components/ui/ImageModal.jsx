@@ -36,7 +36,7 @@ export default function ImageModal({
           <div className="space-y-4">
             <div className="relative group">
               <img
-                src={image.url || "/placeholder.svg"}
+                src={image.preview_url || image.url || "/placeholder.svg"}
                 alt={image.title}
                 className="w-full rounded-lg shadow-lg transition-transform duration-300 hover:scale-105"
               />
@@ -99,7 +99,7 @@ export default function Album({ tag, images, onImageClick, open, onToggle, onDel
                     style={{ animationDelay: `${idx * 80}ms` }}
                   >
                     <img
-                      src={img.url || "/placeholder.svg"}
+                      src={img.thumbnail_url || img.url || "/placeholder.svg"}
                       alt={img.title}
                       className="w-full h-full object-cover transition-transform duration-300 hover:scale-110"
                     />
@@ -152,7 +152,7 @@ export default function Album({ tag, images, onImageClick, open, onToggle, onDel
                     }}
                   >
                     <img
-                      src={img.url || "/placeholder.svg"}
+                      src={img.thumbnail_url || img.url || "/placeholder.svg"}
                       alt={img.title}
                       className="w-full h-full object-cover transition-transform duration-500 group-hover/item:scale-110"
                     />
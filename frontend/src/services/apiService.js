@@ -40,6 +40,12 @@ class ApiService {
         return response.data;
     }
 
+    async getAlbumSummaries(userId) {
+        // Conteggio, byte totali, ultima modifica e copertina per album, senza scaricare le immagini
+        const response = await this.client.get(`/api/albums/${userId}/summary`);
+        return response.data.albums || [];
+    }
+
     async deleteAlbum(userId, albumName) {
         const token = localStorage.getItem('idToken');
         const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
@@ -75,10 +81,18 @@ class ApiService {
 
     async getUserImages(userId) {
         try {
-            const response = await this.client.get(`/api/images/${userId}`);
+            // Gli album arrivano come riferimenti (filename): le immagini non vengono duplicate nel payload
+            const response = await this.client.get(`/api/images/${userId}`, {
+                params: { album_format: 'ref' }
+            });
+            const images = response.data.images || [];
+            const byFilename = new Map(images.map(img => [img.filename, img]));
             return {
-                images: response.data.images || [],
-                album: response.data.album || []
+                images,
+                album: (response.data.album || []).map(album => ({
+                    ...album,
+                    images: album.images.map(filename => byFilename.get(filename)).filter(Boolean)
+                }))
             };
         } catch (error) {
             console.error('Errore nel recupero immagini', error);
@@ -86,18 +100,33 @@ class ApiService {
         }
     }
 
-    async searchImagesByTag(userId, tag) {
+    async searchImagesByTag(userId, tag, { mode = 'and', limit = 50, cursor = null } = {}) {
         try {
-            const allImages = await this.getUserImages(userId);
-            const filtered = allImages.images.filter(img =>
-                img.tags && img.tags.some(imgTag =>
-                    imgTag.toLowerCase().includes(tag.toLowerCase())
-                )
-            );
-            return { images: filtered };
+            // Ricerca sull'indice dei tag del backend: "a,b" cerca più tag insieme
+            const tags = Array.isArray(tag) ? tag.join(',') : tag;
+            const response = await this.client.get(`/api/search/${userId}`, {
+                params: { tags, mode, limit, ...(cursor ? { cursor } : {}) }
+            });
+            return {
+                images: response.data.images || [],
+                total: response.data.total || 0,
+                nextCursor: response.data.next_cursor || null
+            };
         } catch (error) {
             console.error('Errore nella ricerca per tag', error);
-            return { images: [] };
+            return { images: [], total: 0, nextCursor: null };
+        }
+    }
+
+    async suggestTags(userId, prefix, limit = 10) {
+        try {
+            const response = await this.client.get(`/api/tags/${userId}/suggest`, {
+                params: { prefix, limit }
+            });
+            return { suggestions: response.data.suggestions || [] };
+        } catch (error) {
+            console.error('Errore nel suggerimento tag', error);
+            return { suggestions: [] };
         }
     }
 
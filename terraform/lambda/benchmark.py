@@ -0,0 +1,249 @@
+"""
+Benchmark locale della Lambda di analisi immagini.
+
+Rekognition e DynamoDB sono sostituiti da stand-in in memoria (con latenza
+simulata opzionale), quindi il benchmark misura solo il costo del codice della
+Lambda: import del modulo (boto3 incluso) e prima invocazione in un processo
+nuovo (cold), invocazioni ripetute sullo stesso processo (warm).
+
+Uso:
+    python benchmark.py [--cold-runs 5] [--warm-runs 200] [--records 10] [--latency-ms 0] [--cache-hits]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class StubRekognitionExceptions:
+    class InvalidS3ObjectException(Exception):
+        pass
+
+
+class StubRekognition:
+    exceptions = StubRekognitionExceptions
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def detect_labels(self, Image, MaxLabels=15, MinConfidence=70):
+        if self.latency:
+            time.sleep(self.latency)
+        return {'Labels': [
+            {'Name': 'Cat', 'Confidence': 98.7654},
+            {'Name': 'Animal', 'Confidence': 97.1},
+            {'Name': 'Pet', 'Confidence': 91.25}
+        ]}
+
+
+class StubDynamoDBExceptions:
+    class ConditionalCheckFailedException(Exception):
+        pass
+
+
+class StubDynamoDBClient:
+    exceptions = StubDynamoDBExceptions
+
+
+class StubMeta:
+    client = StubDynamoDBClient
+
+
+# Chiavi primarie delle tabelle usate dalla Lambda (stessi schemi di main.tf)
+TABLE_KEYS = {
+    'ImageLabels': ('ImageKey',),
+    'ImageManifest': ('UserId', 'ImageKey'),
+    'ImageTagIndex': ('Partition', 'Sort')
+}
+
+
+class StubBatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table.items[self.table.key_of(Item)] = Item
+
+    def delete_item(self, Key):
+        self.table.items.pop(self.table.key_of(Key), None)
+
+
+class StubTable:
+    meta = StubMeta
+
+    def __init__(self, latency, key_names):
+        self.latency = latency
+        self.key_names = key_names
+        self.items = {}
+
+    def key_of(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return StubBatchWriter(self)
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        key = self.key_of(Item)
+        # La Lambda usa solo attribute_not_exists sulla chiave (posting dell'indice dei tag)
+        if ConditionExpression and key in self.items:
+            raise StubDynamoDBExceptions.ConditionalCheckFailedException(ConditionExpression)
+        self.items[key] = Item
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(self.key_of(Key))
+        return {'Item': item} if item else {}
+
+    def update_item(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return {}
+
+
+class StubDynamoDBResource:
+    def __init__(self, latency):
+        self.latency = latency
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = StubTable(self.latency, TABLE_KEYS.get(name, ('ImageKey',)))
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        if self.latency:
+            time.sleep(self.latency)
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            responses[name] = [
+                table.items[table.key_of(key)] for key in request['Keys'] if table.key_of(key) in table.items
+            ]
+        return {'Responses': responses}
+
+
+def install_stubs(latency):
+    """Sostituisce boto3.client/resource con gli stand-in prima dell'import della Lambda."""
+    import boto3
+    real_client = boto3.client
+
+    def client(service, *args, **kwargs):
+        if service == 'rekognition':
+            return StubRekognition(latency)
+        return real_client(service, *args, **kwargs)
+
+    boto3.client = client
+    boto3.resource = lambda service, *args, **kwargs: StubDynamoDBResource(latency)
+
+
+def build_event(records, salt=0):
+    return {'Records': [
+        {
+            'eventSource': 'aws:s3',
+            's3': {
+                'bucket': {'name': 'benchmark-bucket'},
+                'object': {'key': f'users/benchmark/image-{i}.jpg', 'size': 1024, 'eTag': f'etag{salt}-{i}'}
+            }
+        }
+        for i in range(records)
+    ]}
+
+
+def check_response(response):
+    """Un'invocazione con errori misurerebbe il percorso di errore: il benchmark si ferma."""
+    body = json.loads(response.get('body') or '{}')
+    if response.get('statusCode') != 200 or body.get('errors'):
+        raise RuntimeError(f"Invocazione non riuscita ({response.get('statusCode')}): {body.get('errors')}")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cold-runs', type=int, default=5)
+    parser.add_argument('--warm-runs', type=int, default=200)
+    parser.add_argument('--records', type=int, default=10, help='record S3 per evento')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='latenza simulata per chiamata AWS')
+    parser.add_argument('--cache-hits', action='store_true', help='ripete lo stesso contenuto (cache label sempre hit)')
+    parser.add_argument('--cold-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+
+    # Il benchmark non deve mai produrre output verboso
+    os.environ['VERBOSE_LOGGING'] = 'false'
+    # Le miniature scaricano l'oggetto da S3: fuori dal perimetro del benchmark
+    os.environ['DERIVATIVES_ENABLED'] = 'false'
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    if args.cold_child:
+        with open(os.devnull, 'w') as devnull:
+            stdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                start = time.perf_counter()
+                install_stubs(latency)
+                sys.path.insert(0, HERE)
+                import lambda_function
+                imported = time.perf_counter()
+                response = lambda_function.lambda_handler(build_event(args.records), None)
+                end = time.perf_counter()
+            finally:
+                sys.stdout = stdout
+        check_response(response)
+        print(json.dumps({'import': imported - start, 'first_invoke': end - imported}))
+        return
+
+    cold = []
+    for _ in range(args.cold_runs):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--cold-child',
+            '--records', str(args.records), '--latency-ms', str(args.latency_ms)
+        ])
+        cold.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    install_stubs(latency)
+    sys.path.insert(0, HERE)
+    import lambda_function
+    warm = []
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            check_response(lambda_function.lambda_handler(build_event(args.records), None))
+            for run in range(args.warm_runs):
+                # Senza --cache-hits ogni invocazione porta contenuti nuovi
+                event = build_event(args.records, 0 if args.cache_hits else run + 1)
+                start = time.perf_counter()
+                response = lambda_function.lambda_handler(event, None)
+                warm.append(time.perf_counter() - start)
+                check_response(response)
+        finally:
+            sys.stdout = stdout
+
+    ms = lambda seconds: f"{seconds * 1000:.2f} ms"
+    print(f"Record per evento: {args.records}, latenza simulata: {args.latency_ms} ms")
+    print(f"Cold ({args.cold_runs} run): import {ms(statistics.median(r['import'] for r in cold))}, "
+          f"prima invocazione {ms(statistics.median(r['first_invoke'] for r in cold))} (mediane)")
+    print(f"Warm ({args.warm_runs} run): p50 {ms(percentile(warm, 50))}, p95 {ms(percentile(warm, 95))}, "
+          f"max {ms(max(warm))}")
+
+
+if __name__ == '__main__':
+    main()
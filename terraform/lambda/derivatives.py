@@ -0,0 +1,99 @@
+import io
+import os
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow arriva dal layer Lambda: senza layer le derivate sono disattivate
+    Image = None
+    ImageOps = None
+
+# Le derivate stanno fuori dal prefisso users/, quindi non riattivano la notifica S3
+DERIVATIVE_PREFIX = os.environ.get('DERIVATIVE_PREFIX', 'derivatives')
+# Dalla più grande alla più piccola: ogni misura viene ricavata dalla precedente
+DERIVATIVE_SIZES = sorted(
+    (int(size) for size in os.environ.get('DERIVATIVE_SIZES', '1024,256').split(',') if size.strip()),
+    reverse=True
+)
+DERIVATIVE_QUALITY = int(os.environ.get('DERIVATIVE_QUALITY', '80'))
+# Quota della memoria della funzione riservata alla decodifica di un'immagine
+DERIVATIVE_MEMORY_SHARE = float(os.environ.get('DERIVATIVE_MEMORY_SHARE', '0.5'))
+# Caso peggiore per pixel durante convert(): sorgente decodificata (fino a 4 byte)
+# più la copia RGB/RGBA (4 byte, Pillow usa 4 byte anche per RGB)
+DECODE_BYTES_PER_PIXEL = 8
+
+
+def _default_max_pixels():
+    memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '512'))
+    return int(memory_mb * 1024 * 1024 * DERIVATIVE_MEMORY_SHARE / DECODE_BYTES_PER_PIXEL)
+
+
+# Oltre questa soglia l'immagine non viene decodificata (protezione memoria).
+# Di default ricavata dalla memoria configurata della Lambda: 512 MB -> ~33 MP
+DERIVATIVE_MAX_PIXELS = int(os.environ.get('DERIVATIVE_MAX_PIXELS') or _default_max_pixels())
+
+
+def derivative_key(key, size):
+    """users/u/album/foto.jpg -> derivatives/256/users/u/album/foto.webp"""
+    base = key.rsplit('.', 1)[0] if '.' in key.rsplit('/', 1)[-1] else key
+    return f"{DERIVATIVE_PREFIX}/{size}/{base}.webp"
+
+
+def generate_derivatives(s3_client, bucket, key):
+    """
+    Genera le miniature WebP dell'immagine. Il file originale viene scaricato su
+    disco temporaneo (non in memoria). I JPEG vengono decodificati già ridotti
+    tramite draft() e DERIVATIVE_MAX_PIXELS si applica alla misura ridotta; gli
+    altri formati sono decodificati a piena risoluzione (entro DERIVATIVE_MAX_PIXELS)
+    e ridotti subito sul posto con reduce(), prima di rotazione EXIF e conversione,
+    che quindi lavorano sulla copia piccola.
+    Restituisce le misure generate, che la Lambda registra nel manifest.
+    """
+    if Image is None:
+        print("Pillow non disponibile: derivate non generate")
+        return []
+
+    created = []
+    with tempfile.TemporaryFile() as source:
+        s3_client.download_fileobj(bucket, key, source)
+        source.seek(0)
+
+        with Image.open(source) as image:
+            largest = DERIVATIVE_SIZES[0]
+            # Solo per JPEG: decodifica direttamente a una scala ridotta (1/2, 1/4, 1/8).
+            # Il controllo dei pixel usa la misura dopo draft(), cioè quella davvero decodificata
+            image.draft('RGB', (largest, largest))
+            width, height = image.size
+            if width * height > DERIVATIVE_MAX_PIXELS:
+                print(f"Immagine troppo grande per le derivate ({width}x{height}): {key}")
+                return []
+
+            current = image
+            if current.mode not in ('RGB', 'RGBA'):
+                # Palette e scale di grigi a 16 bit non supportano reduce() né LANCZOS
+                current = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                # La sorgente decodificata non serve più: la memoria viene liberata subito
+                image.close()
+            # In place: reduce() intero fino a 2x la misura più grande, poi LANCZOS.
+            # La sorgente a piena risoluzione viene sostituita, non affiancata.
+            current.thumbnail((largest, largest), Image.LANCZOS, reducing_gap=2.0)
+            # Rotazione sulla miniatura: il riquadro quadrato non cambia con la rotazione
+            ImageOps.exif_transpose(current, in_place=True)
+
+            for size in DERIVATIVE_SIZES:
+                current.thumbnail((size, size), Image.LANCZOS)
+                buffer = io.BytesIO()
+                current.save(buffer, format='WEBP', quality=DERIVATIVE_QUALITY, method=4)
+                buffer.seek(0)
+                target = derivative_key(key, size)
+                s3_client.put_object(
+                    Bucket=bucket,
+                    Key=target,
+                    Body=buffer,
+                    ContentType='image/webp',
+                    CacheControl='public, max-age=31536000, immutable'
+                )
+                created.append(size)
+
+    print(f"Derivate generate per {key}: {created}")
+    return created
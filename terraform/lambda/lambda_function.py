@@ -1,50 +1,165 @@
 import boto3
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import urllib.parse
 from decimal import Decimal
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-table = dynamodb.Table('ImageLabels')
+REGION = os.environ.get('REGION', 'us-east-1')
+DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'ImageLabels')
+# Manifest per utente del backend: la Lambda aggiunge solo LabelNames e Labels alla voce dell'immagine
+MANIFEST_TABLE = os.environ.get('MANIFEST_TABLE', 'ImageManifest')
+# Indice invertito tag -> immagini del backend (stesso schema di utils/tag_index.py)
+TAG_INDEX_TABLE = os.environ.get('TAG_INDEX_TABLE', 'ImageTagIndex')
+# Item contatore delle modifiche per utente (ETag dei listing del backend)
+VERSION_KEY = '#version'
+# Cache dei label per contenuto (ETag + dimensione), con scadenza via TTL DynamoDB
+LABEL_CACHE_TTL_DAYS = int(os.environ.get('LABEL_CACHE_TTL_DAYS', '30'))
+LABEL_CACHE_PREFIX = 'content#'
+# Log completo dell'evento solo se richiesto esplicitamente
+VERBOSE_LOGGING = os.environ.get('VERBOSE_LOGGING', 'false').lower() == 'true'
 
-def lambda_handler(event, context):
-    print("Evento ricevuto:", json.dumps(event, indent=2))
-    
-    # Estrai informazioni dall'evento S3
-    try:
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-        
-        print(f"Bucket: {bucket}")
-        print(f"Key originale: {key}")
-        
-        # Verifica che sia un'immagine supportata
-        supported_formats = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
-        if not any(key.lower().endswith(fmt) for fmt in supported_formats):
-            print(f"Formato file non supportato: {key}")
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'Formato file non supportato'})
-            }
-        
-        # Inizializza client Rekognition
-        rekognition = boto3.client('rekognition', region_name='us-east-1')
-        s3_client = boto3.client('s3', region_name='us-east-1')
-        
-        # Verifica che l'oggetto esista
+SUPPORTED_FORMATS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+# Analisi parallele massime per invocazione, da tenere sotto il limite TPS di Rekognition
+REKOGNITION_CONCURRENCY = int(os.environ.get('REKOGNITION_CONCURRENCY', '5'))
+# Miniature WebP (modulo derivatives, richiede Pillow dal layer)
+DERIVATIVES_ENABLED = os.environ.get('DERIVATIVES_ENABLED', 'true').lower() == 'true'
+# Derivate in un pool separato: una decodifica alla volta per non superare la memoria
+DERIVATIVE_CONCURRENCY = int(os.environ.get('DERIVATIVE_CONCURRENCY', '1'))
+
+# Client creati alla prima invocazione e riutilizzati dalle invocazioni warm
+_rekognition = None
+_dynamodb = None
+_table = None
+_manifest_table = None
+_tag_index_table = None
+_s3 = None
+
+def get_rekognition():
+    global _rekognition
+    if _rekognition is None:
+        _rekognition = boto3.client('rekognition', region_name=REGION)
+    return _rekognition
+
+def get_dynamodb():
+    global _dynamodb
+    if _dynamodb is None:
+        _dynamodb = boto3.resource('dynamodb', region_name=REGION)
+    return _dynamodb
+
+def get_manifest_table():
+    global _manifest_table
+    if _manifest_table is None:
+        _manifest_table = get_dynamodb().Table(MANIFEST_TABLE)
+    return _manifest_table
+
+def get_tag_index_table():
+    global _tag_index_table
+    if _tag_index_table is None:
+        _tag_index_table = get_dynamodb().Table(TAG_INDEX_TABLE)
+    return _tag_index_table
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client('s3', region_name=REGION)
+    return _s3
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = get_dynamodb().Table(DYNAMODB_TABLE)
+    return _table
+
+class ObjectNotFound(Exception):
+    pass
+
+def extract_user_id(key):
+    # Le chiavi hanno la forma users/{user_id}/[album/]file
+    parts = key.split('/')
+    if len(parts) >= 3 and parts[0] == 'users' and parts[1]:
+        return parts[1]
+    return None
+
+def s3_records_of(record):
+    """
+    Restituisce i record S3 contenuti in un record dell'evento: la notifica S3
+    diretta oppure un messaggio SQS con la notifica S3 nel body.
+    """
+    if record.get('eventSource') == 'aws:sqs':
+        body = json.loads(record['body'])
+        # s3:TestEvent e messaggi senza Records non contengono immagini
+        return body.get('Records', [])
+    if 's3' in record:
+        return [record]
+    return []
+
+def content_cache_key(etag, size):
+    # Stesso ETag e stessa dimensione => stessi byte (la chiave S3 cambia ad ogni upload)
+    if not etag:
+        return None
+    etag = etag.strip('"')
+    return f"{LABEL_CACHE_PREFIX}{etag}#{size}"
+
+def lookup_cached_labels(cache_keys):
+    """
+    Legge con BatchGetItem i label già calcolati per i contenuti indicati.
+    Restituisce {cache_key: Labels}; chiavi scadute o non elaborate valgono come miss.
+    """
+    found = {}
+    now = int(time.time())
+    cache_keys = list(dict.fromkeys(cache_keys))
+    for i in range(0, len(cache_keys), 100):
+        chunk = cache_keys[i:i + 100]
         try:
-            s3_client.head_object(Bucket=bucket, Key=key)
-            print(f"Oggetto S3 trovato: s3://{bucket}/{key}")
+            response = get_dynamodb().batch_get_item(RequestItems={
+                DYNAMODB_TABLE: {
+                    'Keys': [{'ImageKey': cache_key} for cache_key in chunk],
+                    'ProjectionExpression': 'ImageKey, Labels, ExpiresAt'
+                }
+            })
         except Exception as e:
-            print(f"Oggetto S3 non trovato: {e}")
-            return {
-                'statusCode': 404,
-                'body': json.dumps({'error': f'Oggetto non trovato: {str(e)}'})
-            }
-        
-        print(f" Inizio analisi immagine: s3://{bucket}/{key}")
-        
-        # Analizza l'immagine con Rekognition
+            print(f"Lettura cache label non riuscita: {str(e)}")
+            continue
+        for item in response.get('Responses', {}).get(DYNAMODB_TABLE, []):
+            # Il TTL DynamoDB può rimuovere gli item con ritardo: controlla la scadenza
+            if int(item.get('ExpiresAt', 0)) > now:
+                found[item['ImageKey']] = item['Labels']
+    return found
+
+def build_item(bucket, key, labels, processed_by='ImageAnalysisFunction'):
+    # Tutti i valori numerici come Decimal.
+    # UserId alimenta l'indice UserIdIndex usato da /api/tags
+    user_id = extract_user_id(key)
+    item = {
+        'ImageKey': key,
+        'Bucket': bucket,
+        'Labels': labels,
+        'LabelNames': [label['Name'] for label in labels],  # Solo i nomi per ricerca
+        'Timestamp': datetime.utcnow().isoformat(),
+        'TotalLabels': Decimal(len(labels)),  # Converti in Decimal
+        'ProcessedBy': processed_by
+    }
+    if user_id:
+        item['UserId'] = user_id
+    return item
+
+def build_cache_item(cache_key, labels):
+    return {
+        'ImageKey': cache_key,
+        'Labels': labels,
+        'ExpiresAt': Decimal(int(time.time()) + LABEL_CACHE_TTL_DAYS * 86400)
+    }
+
+def analyze_image(rekognition, bucket, key):
+    """Analizza un'immagine con Rekognition e restituisce i label convertiti per DynamoDB."""
+    print(f" Inizio analisi immagine: s3://{bucket}/{key}")
+
+    # Analizza l'immagine con Rekognition. Un oggetto mancante viene segnalato da
+    # Rekognition stesso (InvalidS3ObjectException), senza una head_object preventiva.
+    try:
         response = rekognition.detect_labels(
             Image={
                 'S3Object': {
@@ -55,61 +170,223 @@ def lambda_handler(event, context):
             MaxLabels=15,
             MinConfidence=70
         )
-        
-        # Estrai i label - CORREZIONE: Converti float in Decimal per DynamoDB
-        labels = []
-        label_names = []
-        for label in response['Labels']:
-            # Converti la confidenza da float a Decimal
-            confidence_value = Decimal(str(round(label['Confidence'], 2)))
-            
-            labels.append({
-                'Name': label['Name'],
-                'Confidence': confidence_value
-            })
-            label_names.append(label['Name'])
-        
-        print(f"Labels trovati ({len(labels)}):", label_names)
-        
-        # Salva i risultati in DynamoDB - CORREZIONE: Tutti i valori numerici come Decimal
-        item = {
-            'ImageKey': key,
-            'Bucket': bucket,
-            'Labels': labels,
-            'LabelNames': label_names,  # Solo i nomi per ricerca
-            'Timestamp': datetime.utcnow().isoformat(),
-            'TotalLabels': Decimal(len(labels)),  # Converti in Decimal
-            'ProcessedBy': 'ImageAnalysisFunction'
-        }
-        
-        table.put_item(Item=item)
-        print(f"Dati salvati in DynamoDB per: {key}")
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Analisi completata con successo',
-                'imageKey': key,
-                'bucket': bucket,
-                'labelsFound': len(labels),
-                'labels': label_names
-            })
-        }
+    except rekognition.exceptions.InvalidS3ObjectException as e:
+        raise ObjectNotFound(str(e))
+
+    # Estrai i label - CORREZIONE: Converti float in Decimal per DynamoDB
+    labels = []
+    for label in response['Labels']:
+        # Converti la confidenza da float a Decimal
+        confidence_value = Decimal(str(round(label['Confidence'], 2)))
 
-    except Exception as e:
-        error_msg = f"Errore durante l'analisi: {str(e)}"
-        print(f" {error_msg}")
-        
-        # Log dettagliato dell'errore
-        import traceback
-        print("Stack trace completo:")
-        traceback.print_exc()
-        
+        labels.append({
+            'Name': label['Name'],
+            'Confidence': confidence_value
+        })
+
+    print(f"Labels trovati per {key} ({len(labels)}):", [label['Name'] for label in labels])
+    return labels
+
+def merge_manifest_labels(item):
+    # SET dei soli label: la voce può essere creata prima o dopo dal backend
+    get_manifest_table().update_item(
+        Key={'UserId': item['UserId'], 'ImageKey': item['ImageKey']},
+        UpdateExpression='SET LabelNames = :names, Labels = :labels',
+        ExpressionAttributeValues={':names': item['LabelNames'], ':labels': item['Labels']}
+    )
+    index_labels(item)
+
+def normalize_tag(tag):
+    return ' '.join(str(tag).split()).lower()
+
+def index_labels(item):
+    # Posting scritto solo se non esiste: con i retry SQS il conteggio del tag non raddoppia
+    table = get_tag_index_table()
+    for label in item['Labels']:
+        tag = normalize_tag(label['Name'])
+        try:
+            table.put_item(
+                Item={
+                    'Partition': f"T#{item['UserId']}#{tag}",
+                    'Sort': item['ImageKey'],
+                    'Confidence': label['Confidence']
+                },
+                ConditionExpression='attribute_not_exists(#sort)',
+                ExpressionAttributeNames={'#sort': 'Sort'}
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+        table.update_item(
+            Key={'Partition': f"V#{item['UserId']}", 'Sort': tag},
+            UpdateExpression='ADD #count :one SET #label = if_not_exists(#label, :label)',
+            ExpressionAttributeNames={'#count': 'Count', '#label': 'Label'},
+            ExpressionAttributeValues={':one': Decimal(1), ':label': label['Name']}
+        )
+
+def bump_user_version(user_id):
+    get_manifest_table().update_item(
+        Key={'UserId': user_id, 'ImageKey': VERSION_KEY},
+        UpdateExpression='ADD Version :one',
+        ExpressionAttributeValues={':one': Decimal(1)}
+    )
+
+def record_derivatives(user_id, key, sizes):
+    # Il backend emette thumbnail_url/preview_url solo per le misure elencate qui
+    get_manifest_table().update_item(
+        Key={'UserId': user_id, 'ImageKey': key},
+        UpdateExpression='SET Derivatives = :sizes',
+        ExpressionAttributeValues={':sizes': sizes}
+    )
+
+def create_derivatives(bucket, key):
+    # Import ritardato: Pillow pesa sul cold start ed è usato solo qui
+    from derivatives import generate_derivatives
+    sizes = generate_derivatives(get_s3(), bucket, key)
+    user_id = extract_user_id(key)
+    if sizes and user_id:
+        record_derivatives(user_id, key, sizes)
+    return sizes
+
+def lambda_handler(event, context):
+    if VERBOSE_LOGGING:
+        print("Evento ricevuto:", json.dumps(event, indent=2))
+    else:
+        print(f"Evento ricevuto: {len(event.get('Records', []))} record")
+
+    jobs = []
+    errors = []
+    failed_messages = set()
+    for record in event.get('Records', []):
+        message_id = record.get('messageId') if record.get('eventSource') == 'aws:sqs' else None
+        try:
+            for s3_record in s3_records_of(record):
+                bucket = s3_record['s3']['bucket']['name']
+                key = urllib.parse.unquote_plus(s3_record['s3']['object']['key'], encoding='utf-8')
+                # Verifica che sia un'immagine supportata
+                if not any(key.lower().endswith(fmt) for fmt in SUPPORTED_FORMATS):
+                    print(f"Formato file non supportato: {key}")
+                    continue
+                s3_object = s3_record['s3']['object']
+                cache_key = content_cache_key(s3_object.get('eTag'), s3_object.get('size'))
+                jobs.append((message_id, bucket, key, cache_key))
+        except Exception as e:
+            print(f"Record non valido: {str(e)}")
+            errors.append({'imageKey': 'unknown', 'error': str(e)})
+            if message_id:
+                failed_messages.add(message_id)
+
+    # Contenuti già analizzati: i label vengono copiati senza chiamare Rekognition
+    cached = lookup_cached_labels([job[3] for job in jobs if job[3]])
+    results = []
+    pending = []
+    for message_id, bucket, key, cache_key in jobs:
+        if cache_key in cached:
+            print(f"Label da cache per {key} ({cache_key})")
+            results.append((message_id, build_item(bucket, key, cached[cache_key], 'ImageAnalysisFunction (cache)')))
+        else:
+            pending.append((message_id, bucket, key, cache_key))
+
+    rekognition = get_rekognition() if pending else None
+
+    # I record restanti vengono analizzati in parallelo, con concorrenza limitata
+    cache_items = {}
+    # Utenti con nuove derivate nel manifest: anche i loro listing vanno rivalidati
+    derivative_users = set()
+    with ThreadPoolExecutor(max_workers=REKOGNITION_CONCURRENCY) as pool, \
+            ThreadPoolExecutor(max_workers=DERIVATIVE_CONCURRENCY) as derivative_pool:
+        # Le miniature vengono generate in parallelo all'analisi, anche per i contenuti in cache
+        derivative_jobs = [
+            (key, derivative_pool.submit(create_derivatives, bucket, key))
+            for _, bucket, key, _ in (jobs if DERIVATIVES_ENABLED else [])
+        ]
+
+        # Contenuti identici nello stesso evento vengono analizzati una sola volta
+        analyses = {}
+        futures = []
+        for message_id, bucket, key, cache_key in pending:
+            group = cache_key or key
+            if group not in analyses:
+                analyses[group] = pool.submit(analyze_image, rekognition, bucket, key)
+            futures.append((message_id, bucket, key, cache_key, analyses[group]))
+        for message_id, bucket, key, cache_key, future in futures:
+            try:
+                labels = future.result()
+                results.append((message_id, build_item(bucket, key, labels)))
+                if cache_key:
+                    cache_items[cache_key] = build_cache_item(cache_key, labels)
+            except ObjectNotFound as e:
+                # Oggetto eliminato prima dell'analisi: ritentare non servirebbe
+                print(f"Oggetto S3 non trovato, ignorato: {key} ({str(e)})")
+            except Exception as e:
+                print(f" Errore durante l'analisi di {key}: {str(e)}")
+                errors.append({'imageKey': key, 'error': str(e)})
+                if message_id:
+                    failed_messages.add(message_id)
+
+        for key, future in derivative_jobs:
+            try:
+                user_id = extract_user_id(key)
+                if future.result() and user_id:
+                    derivative_users.add(user_id)
+            except Exception as e:
+                # Le miniature mancanti non bloccano l'analisi: il frontend usa l'originale
+                print(f" Errore durante la generazione delle derivate di {key}: {str(e)}")
+
+    # Salva i risultati in DynamoDB con un unico batch writer
+    items = [(message_id, item) for message_id, item in results if message_id not in failed_messages]
+    if items:
+        try:
+            with get_table().batch_writer(overwrite_by_pkeys=['ImageKey']) as batch:
+                for _, item in items:
+                    batch.put_item(Item=item)
+                for cache_item in cache_items.values():
+                    batch.put_item(Item=cache_item)
+            print(f"Dati salvati in DynamoDB per {len(items)} immagini")
+        except Exception as e:
+            print(f" Errore durante il salvataggio in DynamoDB: {str(e)}")
+            for message_id, item in items:
+                errors.append({'imageKey': item['ImageKey'], 'error': str(e)})
+                if message_id:
+                    failed_messages.add(message_id)
+            items = []
+
+    # Label nel manifest e nell'indice dei tag del backend, in parallelo (solo chiavi users/{user_id}/...)
+    manifest_items = [(message_id, item) for message_id, item in items if 'UserId' in item]
+    if manifest_items:
+        with ThreadPoolExecutor(max_workers=REKOGNITION_CONCURRENCY) as pool:
+            updates = [(message_id, item, pool.submit(merge_manifest_labels, item)) for message_id, item in manifest_items]
+            for message_id, item, future in updates:
+                try:
+                    future.result()
+                except Exception as e:
+                    # Il retry è economico: i label arrivano dalla cache per contenuto
+                    print(f" Errore aggiornamento manifest per {item['ImageKey']}: {str(e)}")
+                    errors.append({'imageKey': item['ImageKey'], 'error': str(e)})
+                    if message_id:
+                        failed_messages.add(message_id)
+
+    # Un incremento per utente: i listing in cache nel browser vengono rivalidati
+    user_ids = sorted({item['UserId'] for _, item in manifest_items} | derivative_users)
+    if user_ids:
+        with ThreadPoolExecutor(max_workers=REKOGNITION_CONCURRENCY) as pool:
+            for user_id, future in [(user_id, pool.submit(bump_user_version, user_id)) for user_id in user_ids]:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f" Errore incremento versione per {user_id}: {str(e)}")
+
+    # Con SQS vengono ritentati solo i messaggi falliti
+    if any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', [])):
         return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': error_msg,
-                'imageKey': key if 'key' in locals() else 'unknown',
-                'bucket': bucket if 'bucket' in locals() else 'unknown'
-            })
+            'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed_messages)]
         }
+
+    return {
+        'statusCode': 500 if errors else 200,
+        'body': json.dumps({
+            'message': 'Analisi completata' if not errors else 'Analisi completata con errori',
+            'processed': [item['ImageKey'] for _, item in items],
+            'labelsFound': {item['ImageKey']: len(item['Labels']) for _, item in items},
+            'errors': errors
+        })
+    }
@@ -15,6 +15,13 @@ provider "aws" {
 
 }
 
+# Layer con Pillow per le miniature WebP (terraform/lambda/derivatives.py).
+# Vuoto: la Lambda analizza le immagini ma non genera le derivate.
+variable "pillow_layer_arn" {
+  type    = string
+  default = ""
+}
+
 #######################
 # Roles
 #######################
@@ -246,6 +253,12 @@ resource "aws_iam_policy" "lambda_image_analysis_policy" {
           "arn:aws:s3:::imagegallery-1-us-east-1/*"
         ]
       },
+      {
+        # Le miniature vengono scritte solo sotto derivatives/
+        Action   = ["s3:PutObject"],
+        Effect   = "Allow",
+        Resource = "arn:aws:s3:::imagegallery-1-us-east-1/derivatives/*"
+      },
       {
         Action = [
           "rekognition:DetectLabels",
@@ -258,12 +271,26 @@ resource "aws_iam_policy" "lambda_image_analysis_policy" {
       {
         Action = [
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
+          "dynamodb:BatchGetItem",
           "dynamodb:GetItem",
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem"
         ],
         Effect   = "Allow",
         Resource = "arn:aws:dynamodb:us-east-1:*:table/ImageLabels"
+      },
+      {
+        # La Lambda aggiunge LabelNames alle voci del manifest
+        Action   = ["dynamodb:UpdateItem"],
+        Effect   = "Allow",
+        Resource = "arn:aws:dynamodb:us-east-1:*:table/ImageManifest"
+      },
+      {
+        # Posting dei label e conteggi del vocabolario nell'indice dei tag
+        Action   = ["dynamodb:PutItem", "dynamodb:UpdateItem"],
+        Effect   = "Allow",
+        Resource = "arn:aws:dynamodb:us-east-1:*:table/ImageTagIndex"
       }
     ]
   })
@@ -286,13 +313,79 @@ resource "aws_dynamodb_table" "image_labels" {
     type = "S"
   }
 
+  attribute {
+    name = "UserId"
+    type = "S"
+  }
+
   hash_key = "ImageKey"
 
+  # Accesso per utente usato da /api/tags (Query invece di Scan)
+  global_secondary_index {
+    name               = "UserIdIndex"
+    hash_key           = "UserId"
+    range_key          = "ImageKey"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["LabelNames", "Labels"]
+  }
+
+  # Scadenza degli item cache "content#..." della Lambda (label per contenuto)
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
   tags = {
     Name = "ImageLabels"
   }
 }
 
+# Manifest per utente delle immagini e degli album (listing senza S3)
+resource "aws_dynamodb_table" "image_manifest" {
+  name         = "ImageManifest"
+  billing_mode = "PAY_PER_REQUEST"
+
+  attribute {
+    name = "UserId"
+    type = "S"
+  }
+
+  attribute {
+    name = "ImageKey"
+    type = "S"
+  }
+
+  hash_key  = "UserId"
+  range_key = "ImageKey"
+
+  tags = {
+    Name = "ImageManifest"
+  }
+}
+
+# Indice invertito per utente: posting "T#{user}#{tag}" -> ImageKey e vocabolario "V#{user}" -> tag
+resource "aws_dynamodb_table" "image_tag_index" {
+  name         = "ImageTagIndex"
+  billing_mode = "PAY_PER_REQUEST"
+
+  attribute {
+    name = "Partition"
+    type = "S"
+  }
+
+  attribute {
+    name = "Sort"
+    type = "S"
+  }
+
+  hash_key  = "Partition"
+  range_key = "Sort"
+
+  tags = {
+    Name = "ImageTagIndex"
+  }
+}
+
 #######################
 # Lambda Functions (local ZIP version)
 #######################
@@ -301,17 +394,22 @@ resource "aws_lambda_function" "image_analysis" {
   role          = aws_iam_role.lambda_image_analysis.arn
   handler       = "lambda_function.lambda_handler"
   runtime       = "python3.9"
-  timeout       = 30
-  memory_size   = 128
+  timeout       = 60
+  # DERIVATIVE_MAX_PIXELS è ricavato da questo valore (metà della memoria per una decodifica)
+  memory_size   = 512
   architectures = ["x86_64"]
+  layers        = var.pillow_layer_arn != "" ? [var.pillow_layer_arn] : []
 
   filename         = "${path.module}/lambda/image_analysis.zip"
   source_code_hash = filebase64sha256("${path.module}/lambda/image_analysis.zip")
 
   environment {
     variables = {
-      DYNAMODB_TABLE = aws_dynamodb_table.image_labels.name
-      REGION         = "us-east-1"
+      DYNAMODB_TABLE      = aws_dynamodb_table.image_labels.name
+      MANIFEST_TABLE      = aws_dynamodb_table.image_manifest.name
+      TAG_INDEX_TABLE     = aws_dynamodb_table.image_tag_index.name
+      REGION              = "us-east-1"
+      DERIVATIVES_ENABLED = var.pillow_layer_arn != "" ? "true" : "false"
     }
   }
 